@@ -2,6 +2,10 @@
 ASGI config for lidlboards project.
 
 It exposes the ASGI callable as a module-level variable named ``application``.
+When LIVE_UPDATES is enabled, the live leaderboard stream is served by its own async
+application, every other request by Django. Serve it with uvicorn (the "live" extra):
+
+    uvicorn lidlboards.asgi:application --workers 4
 
 For more information on this file, see
 https://docs.djangoproject.com/en/4.0/howto/deployment/asgi/
@@ -9,8 +13,18 @@ https://docs.djangoproject.com/en/4.0/howto/deployment/asgi/
 
 import os
 
+from django.conf import settings
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "lidlboards.settings")
 
-application = get_asgi_application()
+django_application = get_asgi_application()
+
+# Needs the apps to be loaded by get_asgi_application()
+from pubg.live import LIVE_PATH, live_application  # noqa: E402
+
+
+async def application(scope, receive, send):
+    if settings.LIVE_UPDATES and scope["type"] == "http" and scope["path"] == LIVE_PATH:
+        return await live_application(scope, receive, send)
+    return await django_application(scope, receive, send)
@@ -129,3 +129,29 @@ STATIC_URL = "static/"
 DEFAULT_AUTO_FIELD = "django.db.models.BigAutoField"
 
 DJANGO_TABLES2_TEMPLATE = "table.html"
+
+# Codec used to store new match telemetry: "gzip", or "zstd" (needs the zstandard package).
+# Blobs written with any codec stay readable.
+TELEMETRY_CODEC = "gzip"
+
+# Touched by every new generation of the stats, so that each process knows when to reload
+# the values it keeps in memory without querying the database (see pubg.models.Website.cached)
+GENERATION_STAMP_FILE = BASE_DIR / ".generation"
+
+# Push the leaderboard changes to the rankings page over Server-Sent Events (see pubg.live).
+# The stream needs the project to be served by an ASGI server, installed with the "live" extra:
+#     uvicorn lidlboards.asgi:application --workers 4
+# Leave it off under a WSGI server like gunicorn, which can't serve the stream.
+LIVE_UPDATES = False
+
+# Rendered pages, shared by all worker processes. Their keys contain the generation of the
+# stats, so a new generation makes them stale (see pubg.views.cache_page_by_generation).
+CACHES = {
+    "default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"},
+    "pages": {
+        "BACKEND": "django.core.cache.backends.filebased.FileBasedCache",
+        "LOCATION": BASE_DIR / ".page_cache",
+        "TIMEOUT": 24 * 60 * 60,
+        "OPTIONS": {"MAX_ENTRIES": 20000},
+    },
+}
@@ -51,3 +51,16 @@ WEAPON_NAMES = {
     "Damage_Explosion_PanzerFaustWarhead": "Panzerfaust",
     "Damage_Gun": "Gun",
 }
+
+# Weapons counted in each weapon column of the kill score ranking
+KILLSCORE_TABLE_WEAPONS = {
+    "vehicle_explosion": ("Damage_Explosion_Vehicle",),
+    "punch": ("Damage_Punch", "Damage_Melee"),
+    "c4": ("Damage_Explosion_C4",),
+    "molotov": ("Damage_Molotov",),
+    "grenade": ("Damage_Explosion_Grenade",),
+    "throw": ("Damage_MeleeThrow",),
+    "vehicle": ("Damage_VehicleHit",),
+    "panzerfaust": ("Damage_Explosion_PanzerFaustWarhead",),
+    "gun": ("Damage_Gun",),
+}
@@ -1,40 +1,197 @@
+import hashlib
+import logging
+import os
 import requests
+import threading
+import time
+import zlib
+from pathlib import Path
 from pprint import pprint
 from os import getenv
+from urllib.parse import urlsplit
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
-API_URL = "https://api.pubg.com/shards/steam/"
+logger = logging.getLogger(__name__)
+
+# Both can point to a local stand-in server, see pubg.fakeapi
+API_URL = getenv("PUBG_API_URL", "https://api.pubg.com/shards/steam/")
+TELEMETRY_URL = getenv("PUBG_TELEMETRY_URL")
 API_KEY = getenv("PUBG_API_KEY")
 HEADERS = {"Authorization": f"Bearer {API_KEY}", "Accept": "application/vnd.api+json"}
+# Maximum number of IDs accepted by the filter[playerIds] parameter of the players endpoint
+PLAYERS_PER_REQUEST = 10
+
+# Responses are cached on disk, set PUBG_API_CACHE_DIR to an empty string to disable it
+API_CACHE_DIR = getenv("PUBG_API_CACHE_DIR", str(Path(__file__).parent.parent / ".api_cache"))
+API_CACHE_MAX_SIZE = int(getenv("PUBG_API_CACHE_MAX_SIZE", 2 * 2**30))
+# Matches and telemetry never change once a match is over, players get new matches
+PLAYER_MAX_AGE = 5 * 60
 
 
 class APIError(Exception):
     pass
 
 
+class ResponseCache:
+    """
+    Bodies of successful responses stored on disk, keyed by the SHA-256 of their URL
+    The modification time of an entry is when it was stored, to expire it, and its access
+    time is when it was last used: past max_size bytes, the least recently used entries are
+    evicted. Entries are written atomically, so several processes can share a cache.
+    """
+
+    def __init__(self, directory: str | Path, max_size: int):
+        self.directory = Path(directory)
+        self.max_size = max_size
+        self.size = None
+        self.lock = threading.Lock()
+
+    def path(self, url: str) -> Path:
+        key = hashlib.sha256(url.encode()).hexdigest()
+        return self.directory / key[:2] / key
+
+    def entries(self) -> list[tuple[os.stat_result, Path]]:
+        return [
+            (path.stat(), path)
+            for path in self.directory.glob("*/*")
+            if "." not in path.name  # Skip entries being written
+        ]
+
+    def get(self, url: str, max_age: float | None) -> bytes | None:
+        """Cached body of url, None if it is not cached or older than max_age seconds"""
+        path = self.path(url)
+        try:
+            stat = path.stat()
+            if max_age is not None and time.time() - stat.st_mtime > max_age:
+                return None
+            content = zlib.decompress(path.read_bytes())
+            os.utime(path, (time.time(), stat.st_mtime))
+        except (OSError, zlib.error):
+            return None
+        return content
+
+    def set(self, url: str, content: bytes):
+        path = self.path(url)
+        data = zlib.compress(content, 1)
+        try:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            tmp_path = path.with_name(f"{path.name}.{os.getpid()}.{threading.get_ident()}")
+            tmp_path.write_bytes(data)
+            os.replace(tmp_path, path)
+            with self.lock:
+                if self.size is None:
+                    self.size = sum(stat.st_size for stat, _ in self.entries())
+                else:
+                    self.size += len(data)
+                if self.size > self.max_size:
+                    self.evict()
+        except OSError as e:
+            logger.warning(f"Could not cache the response of {url}: {e}")
+
+    def evict(self):
+        """Remove the least recently used entries until the cache is at 90% of its size"""
+        entries = sorted(self.entries(), key=lambda entry: entry[0].st_atime)
+        self.size = sum(stat.st_size for stat, _ in entries)
+        for stat, path in entries:
+            if self.size <= 0.9 * self.max_size:
+                break
+            path.unlink(missing_ok=True)
+            self.size -= stat.st_size
+
+
+class Client:
+    """
+    HTTP client shared by all API calls
+    Keeps a pool of warm connections per host (api.pubg.com and the telemetry CDN),
+    uses explicit timeouts and retries 429/5xx responses with exponential backoff,
+    waiting for Retry-After when the API sends it
+    Responses can be served from a ResponseCache, see get
+    """
+
+    def __init__(
+        self,
+        connect_timeout: float = 5,
+        read_timeout: float = 60,
+        retries: int = 5,
+        backoff_factor: float = 1,
+        pool_size: int = 16,
+        cache: ResponseCache | None = None,
+    ):
+        self.timeout = (connect_timeout, read_timeout)
+        self.cache = cache
+        retry = Retry(
+            total=retries,
+            backoff_factor=backoff_factor,
+            status_forcelist=(429, 500, 502, 503, 504),
+            allowed_methods=("GET",),
+            respect_retry_after_header=True,
+            raise_on_status=False,
+        )
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=pool_size, max_retries=retry)
+        self.session = requests.Session()
+        self.session.headers.update(HEADERS)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+    def get(self, url: str, max_age: float | None = 0) -> requests.Response:
+        """
+        GET url, using a cached response that is at most max_age seconds old
+        max_age=0 never uses the cache, max_age=None is for responses that never change
+        """
+        cached = self.cache is not None and max_age != 0
+        if cached and (content := self.cache.get(url, max_age)) is not None:
+            req = requests.Response()
+            req.status_code = 200
+            req.url = url
+            req._content = content
+            return req
+
+        try:
+            req = self.session.get(url, timeout=self.timeout)
+        except requests.RequestException as e:
+            raise APIError(None, str(e)) from e
+
+        if req.status_code == 200:
+            if cached:
+                self.cache.set(url, req.content)
+            return req
+        else:
+            raise APIError(req.status_code, req.content)
+
+
+client = Client(cache=ResponseCache(API_CACHE_DIR, API_CACHE_MAX_SIZE) if API_CACHE_DIR else None)
+
+
 def get_player_info(id: str) -> dict:
     url = API_URL + "players/" + id
-    req = requests.get(url, headers=HEADERS)
+    return client.get(url, max_age=PLAYER_MAX_AGE).json()
+
 
-    if req.status_code == 200:
-        return req.json()
-    else:
-        raise APIError(req.status_code, req.content)
+def get_players_info(ids: list[str]) -> list[dict]:
+    """
+    Get info for up to PLAYERS_PER_REQUEST players with a single request
+    Players that don't exist anymore are missing from the result
+    """
+    if len(ids) > PLAYERS_PER_REQUEST:
+        raise ValueError(f"Can't get more than {PLAYERS_PER_REQUEST} players per request")
+    url = API_URL + "players?filter[playerIds]=" + ",".join(ids)
+    try:
+        return client.get(url, max_age=PLAYER_MAX_AGE).json()["data"]
+    except APIError as e:
+        if e.args[0] == 404:
+            # None of the players were found
+            return []
+        raise
 
 
 def get_match_info(id: str) -> dict:
     url = API_URL + "matches/" + id
-    req = requests.get(url, headers=HEADERS)
-
-    if req.status_code == 200:
-        return req.json()
-    else:
-        raise APIError(req.status_code, req.content)
+    return client.get(url, max_age=None).json()
 
 
 def get_telemetry_data(telemetry_url: str) -> bytes:
-    req = requests.get(telemetry_url, headers=HEADERS)
-
-    if req.status_code == 200:
-        return req.content
-    else:
-        raise APIError(req.status_code, req.content)
+    if TELEMETRY_URL:
+        # Keep the path of the telemetry file, but get it from another host
+        telemetry_url = TELEMETRY_URL.rstrip("/") + urlsplit(telemetry_url).path
+    return client.get(telemetry_url, max_age=None).content
@@ -0,0 +1,138 @@
+"""
+Codecs for stored telemetry
+Every blob starts with the magic number of its format, so blobs written with any codec
+(including the original gzip ones) stay readable whatever the current TELEMETRY_CODEC is
+"""
+import gzip
+import io
+from typing import BinaryIO
+
+from django.conf import settings
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+GZIP_MAGIC = b"\x1f\x8b"
+ZSTD_MAGIC = b"\x28\xb5\x2f\xfd"
+
+# zstd dictionaries by dictionary ID, loaded from the database on first use
+_dictionaries = {}
+# zstd codecs of get_codec() by dictionary ID (None without a dictionary) and level
+_zstd_codecs = {}
+
+
+class CodecError(Exception):
+    pass
+
+
+class GzipCodec:
+    name = "gzip"
+
+    def compress(self, data: bytes) -> bytes:
+        return gzip.compress(data)
+
+    @staticmethod
+    def open(blob: bytes) -> BinaryIO:
+        return gzip.GzipFile(fileobj=io.BytesIO(blob))
+
+
+class ZstdCodec:
+    """
+    Zstandard, optionally with a dictionary trained on our own telemetry
+    The dictionary ID is written in every frame, so decompression finds the right dictionary
+    """
+
+    name = "zstd"
+
+    def __init__(self, dictionary: bytes | None = None, level: int = 12):
+        if zstandard is None:
+            raise CodecError("The zstandard package is not installed")
+        self.level = level
+        self.dictionary = zstandard.ZstdCompressionDict(dictionary) if dictionary else None
+
+    def compress(self, data: bytes) -> bytes:
+        compressor = zstandard.ZstdCompressor(level=self.level, dict_data=self.dictionary)
+        return compressor.compress(data)
+
+    @staticmethod
+    def open(blob: bytes) -> BinaryIO:
+        dict_id = zstandard.get_frame_parameters(blob).dict_id
+        dictionary = get_dictionary(dict_id) if dict_id else None
+        decompressor = zstandard.ZstdDecompressor(dict_data=dictionary)
+        return decompressor.stream_reader(io.BytesIO(blob))
+
+
+def get_dictionary(dict_id: int):
+    if dict_id not in _dictionaries:
+        from pubg.models import TelemetryDictionary
+
+        try:
+            data = TelemetryDictionary.objects.get(id=dict_id).data
+        except TelemetryDictionary.DoesNotExist:
+            raise CodecError(f"Unknown zstd dictionary {dict_id}")
+        register_dictionary(dict_id, bytes(data))
+    return _dictionaries[dict_id]
+
+
+def register_dictionary(dict_id: int, data: bytes):
+    _dictionaries[dict_id] = zstandard.ZstdCompressionDict(data)
+
+
+def register_dictionaries(dictionaries: dict[int, bytes]):
+    """Make dictionaries available without database access, e.g. in worker processes"""
+    for dict_id, data in dictionaries.items():
+        register_dictionary(dict_id, data)
+
+
+def train_dictionary(samples: list[bytes], size: int) -> tuple[int, bytes]:
+    """Train a zstd dictionary on telemetry samples, returns its ID and content"""
+    if zstandard is None:
+        raise CodecError("The zstandard package is not installed")
+    dictionary = zstandard.train_dictionary(size, samples)
+    return dictionary.dict_id(), dictionary.as_bytes()
+
+
+def get_codec(name: str | None = None, **kwargs):
+    """
+    Codec used to store new telemetry, TELEMETRY_CODEC from the settings by default
+    zstd uses the most recently trained dictionary, if any
+    """
+    name = name or getattr(settings, "TELEMETRY_CODEC", "gzip")
+    match name:
+        case "gzip":
+            return GzipCodec()
+        case "zstd":
+            if "dictionary" in kwargs:
+                return ZstdCodec(**kwargs)
+            from pubg.models import TelemetryDictionary
+
+            latest = (
+                TelemetryDictionary.objects.order_by("-created_at")
+                .values_list("id", flat=True)
+                .first()
+            )
+            key = (latest, kwargs.get("level"))
+            if key not in _zstd_codecs:
+                data = TelemetryDictionary.objects.get(id=latest).data if latest else None
+                _zstd_codecs[key] = ZstdCodec(bytes(data) if data else None, **kwargs)
+            return _zstd_codecs[key]
+        case _:
+            raise CodecError(f"Unknown telemetry codec {name}")
+
+
+def compress(data: bytes) -> bytes:
+    return get_codec().compress(data)
+
+
+def open_blob(blob: bytes) -> BinaryIO:
+    """Decompressed file object for a stored telemetry blob, whatever codec wrote it"""
+    blob = bytes(blob)
+    if blob.startswith(GZIP_MAGIC):
+        return GzipCodec.open(blob)
+    if blob.startswith(ZSTD_MAGIC):
+        if zstandard is None:
+            raise CodecError("The zstandard package is needed to read this telemetry")
+        return ZstdCodec.open(blob)
+    raise CodecError("Unknown telemetry format")
@@ -1,14 +1,17 @@
 from pubg.models import Website
 from pubg.forms import PlayerSearchForm
 
+# The form is unbound and only rendered, so every page can use the same instance
+PLAYER_SEARCH_FORM = PlayerSearchForm()
+
 
 def add_website_stats_to_context(_):
     return {
-        "update_datetime": Website.objects.get(pk=1).last_update,
+        "update_datetime": Website.cached().last_update,
     }
 
 
 def add_player_search_form_to_context(_):
     return {
-        "player_search_form": PlayerSearchForm(),
+        "player_search_form": PLAYER_SEARCH_FORM,
     }
@@ -0,0 +1,161 @@
+"""
+Local stand-in for the PUBG API and its telemetry CDN, serving recorded responses
+Point the client at it with PUBG_API_URL=http://host:port/shards/steam/ and
+PUBG_TELEMETRY_URL=http://host:port to run the ingestion without network access
+
+Fixtures directory layout:
+    players/<player id>.json     response of players/<id>
+    matches/<match id>.json      response of matches/<id>
+    telemetry/<CDN path>.gz      gzipped telemetry, served as is with Content-Encoding: gzip
+"""
+import gzip
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from urllib.parse import parse_qs, unquote, urlsplit
+
+API_PREFIX = "/shards/steam/"
+CONTENT_TYPE = "application/vnd.api+json"
+
+
+class FixtureStore:
+    def __init__(self, root: str | Path):
+        self.root = Path(root)
+
+    def player_path(self, player_id: str) -> Path:
+        return self.root / "players" / f"{player_id}.json"
+
+    def match_path(self, match_id: str) -> Path:
+        return self.root / "matches" / f"{match_id}.json"
+
+    def telemetry_path(self, telemetry_url: str) -> Path:
+        # The CDN path is kept so that matches/ responses don't need to be rewritten
+        return self.root / "telemetry" / (urlsplit(telemetry_url).path.lstrip("/") + ".gz")
+
+    def exists(self, path: Path) -> bool:
+        """Whether path is a recorded fixture, never true for a file outside of the store"""
+        return path.resolve().is_relative_to(self.root.resolve()) and path.exists()
+
+    def save_player(self, player_info: dict):
+        """Save the response of players/<id>, or one item of a players?filter response"""
+        data = player_info["data"] if "data" in player_info else player_info
+        self._write(self.player_path(data["id"]), json.dumps({"data": data}).encode())
+
+    def save_match(self, match_id: str, match_info: dict):
+        self._write(self.match_path(match_id), json.dumps(match_info).encode())
+
+    def save_telemetry(self, telemetry_url: str, telemetry_data: bytes):
+        self._write(self.telemetry_path(telemetry_url), gzip.compress(telemetry_data))
+
+    @staticmethod
+    def _write(path: Path, content: bytes):
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_bytes(content)
+
+
+class FakeAPIServer(ThreadingHTTPServer):
+    """
+    Serves a FixtureStore, with optional latency and injected failures
+    `error_rate` and `throttle_rate` are the fractions of requests answered with a 500 and
+    with a 429 (with a Retry-After header). Failures are drawn from a seeded generator so
+    that runs can be compared.
+    """
+
+    daemon_threads = True
+
+    def __init__(
+        self,
+        address: tuple[str, int],
+        store: FixtureStore,
+        latency: float = 0,
+        jitter: float = 0,
+        error_rate: float = 0,
+        throttle_rate: float = 0,
+        retry_after: int = 1,
+        seed: int | None = None,
+    ):
+        super().__init__(address, FakeAPIHandler)
+        self.store = store
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.throttle_rate = throttle_rate
+        self.retry_after = retry_after
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.counts = {}
+
+    def draw(self) -> tuple[float, float]:
+        """Latency and failure roll of the next request"""
+        with self.lock:
+            return self.random.uniform(-self.jitter, self.jitter), self.random.random()
+
+    def count(self, status: int):
+        with self.lock:
+            self.counts[status] = self.counts.get(status, 0) + 1
+
+
+class FakeAPIHandler(BaseHTTPRequestHandler):
+    server: FakeAPIServer
+
+    def do_GET(self):
+        jitter, roll = self.server.draw()
+        time.sleep(max(self.server.latency + jitter, 0))
+        if roll < self.server.throttle_rate:
+            return self.respond(429, b"", {"Retry-After": str(self.server.retry_after)})
+        if roll < self.server.throttle_rate + self.server.error_rate:
+            return self.respond(500, b"")
+
+        url = urlsplit(self.path)
+        if url.path.startswith(API_PREFIX):
+            self.api(unquote(url.path[len(API_PREFIX) :]), parse_qs(url.query))
+        else:
+            self.telemetry(self.path)
+
+    def api(self, path: str, query: dict):
+        store = self.server.store
+        match path.split("/"):
+            case ["players"] if "filter[playerIds]" in query:
+                data = []
+                for player_id in query["filter[playerIds]"][0].split(","):
+                    if store.exists(player_path := store.player_path(player_id)):
+                        data.append(json.loads(player_path.read_bytes())["data"])
+                if not data:
+                    return self.respond(404, b'{"errors":[{"title":"Not Found"}]}')
+                self.respond(200, json.dumps({"data": data}).encode())
+            case ["players", player_id]:
+                self.respond_file(store.player_path(player_id))
+            case ["matches", match_id]:
+                self.respond_file(store.match_path(match_id))
+            case _:
+                self.respond(404, b'{"errors":[{"title":"Not Found"}]}')
+
+    def telemetry(self, path: str):
+        self.respond_file(
+            self.server.store.telemetry_path(path),
+            {"Content-Encoding": "gzip"},
+            content_type="application/json",
+        )
+
+    def respond_file(self, path: Path, headers: dict | None = None, content_type=CONTENT_TYPE):
+        if not self.server.store.exists(path):
+            return self.respond(404, b'{"errors":[{"title":"Not Found"}]}')
+        self.respond(200, path.read_bytes(), headers, content_type)
+
+    def respond(
+        self, status: int, body: bytes, headers: dict | None = None, content_type=CONTENT_TYPE
+    ):
+        self.server.count(status)
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        for header, value in (headers or {}).items():
+            self.send_header(header, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
@@ -7,4 +7,6 @@ class PlayerSearchForm(forms.Form):
         "class": "form-control mr-sm-2",
         "placeholder": "Player search",
         "aria-label": "Player search",
+        "autocomplete": "off",
+        "list": "player-suggestions",
     }
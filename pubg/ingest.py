@@ -0,0 +1,78 @@
+import datetime
+import logging
+import os
+import socket
+import uuid
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from pubg.api import APIError
+from pubg.models import IngestJob, LeaseLost, MatchTelemetry
+
+logger = logging.getLogger(__name__)
+
+LEASE_DURATION = datetime.timedelta(minutes=10)
+
+
+def fetch_jobs(jobs: list[IngestJob], workers: int):
+    """
+    Download the data of jobs in a thread pool, with at most `workers` downloads in flight
+    Telemetry is only downloaded for matches that don't have it stored yet
+    Yields (job, match_info, telemetry_data, with_telemetry, error) as downloads finish
+    """
+    stored_telemetry = set(
+        MatchTelemetry.objects.filter(match__in=[job.match_id for job in jobs]).values_list(
+            "match_id", flat=True
+        )
+    )
+
+    def fetch(job):
+        with_telemetry = job.match_id not in stored_telemetry
+        try:
+            return job, *job.fetch(with_telemetry), with_telemetry, None
+        except Exception as e:
+            # Malformed responses too: the job fails and backs off instead of stopping the batch
+            return job, None, None, with_telemetry, e
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        pending = set()
+        for job in jobs:
+            pending.add(executor.submit(fetch, job))
+            if len(pending) >= workers:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    yield future.result()
+        for future in pending:
+            yield future.result()
+
+
+def run_jobs(workers: int = 4, batch_size: int | None = None) -> list[str]:
+    """
+    Lease and process ingestion jobs until none is due
+    Downloads overlap in a thread pool, DB writes all happen in the calling thread, one
+    transaction per job. Several processes can run this at the same time.
+    Returns the IDs of the matches whose ingestion made progress.
+    """
+    worker = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+    workers = max(workers, 1)
+    batch_size = batch_size or 4 * workers
+    processed = []
+    while jobs := IngestJob.lease(worker, batch_size, LEASE_DURATION):
+        for job, match_info, telemetry_data, with_telemetry, error in fetch_jobs(jobs, workers):
+            try:
+                if error is not None:
+                    if not isinstance(error, APIError):
+                        error = repr(error)
+                    logger.warning(f"Could not get info for match {job.match_id}: {error}")
+                    job.fail(str(error))
+                    continue
+                job.apply(match_info, telemetry_data, with_telemetry)
+                processed.append(job.match_id)
+            except LeaseLost as e:
+                logger.warning(str(e))
+            except Exception as e:
+                logger.exception(f"Could not ingest match {job.match_id}")
+                try:
+                    job.fail(repr(e))
+                except LeaseLost as e:
+                    logger.warning(str(e))
+    return processed
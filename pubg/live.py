@@ -0,0 +1,158 @@
+"""
+Server-Sent Events stream of the leaderboard changes, so that the rankings page can update
+while forsen is streaming instead of being reloaded by every viewer
+
+It is a plain ASGI application routed by lidlboards.asgi when LIVE_UPDATES is enabled: idle
+clients are only a queue each, and a single task per process polls the generation stamp file
+and computes the diff of every new generation once for all of them. It bypasses the Django
+middleware, so it validates the Host header against ALLOWED_HOSTS itself.
+"""
+import asyncio
+import io
+import json
+import logging
+
+from asgiref.sync import sync_to_async
+from django.core.exceptions import DisallowedHost
+from django.core.handlers.asgi import ASGIRequest
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import close_old_connections
+
+from pubg.models import LeaderboardSnapshot, generation_stamp
+
+logger = logging.getLogger(__name__)
+
+LIVE_PATH = "/pubg/live/"
+# Seconds between two checks of the generation stamp file
+POLL_INTERVAL = 2
+# Seconds between two comments sent to idle clients, so that proxies keep the connection open
+KEEPALIVE_INTERVAL = 30
+# Milliseconds before a disconnected client reconnects
+RETRY = 10000
+
+
+def sse_event(event: str, data: dict, id: int | None = None) -> bytes:
+    lines = [] if id is None else [f"id: {id}"]
+    lines += [f"event: {event}", f"data: {json.dumps(data, cls=DjangoJSONEncoder)}"]
+    return ("\n".join(lines) + "\n\n").encode()
+
+
+def current_generation() -> int | None:
+    close_old_connections()
+    snapshot = LeaderboardSnapshot.objects.order_by("-generation").values("generation").first()
+    return snapshot["generation"] if snapshot else None
+
+
+def compute_update(since: int | None) -> tuple[int | None, bytes | None]:
+    """The generation and "update" event of the snapshots published after generation `since`"""
+    close_old_connections()
+    current = LeaderboardSnapshot.current()
+    if current is None or current.generation == since:
+        return since, None
+    # The previous snapshot may have been deleted already, then every row is new
+    previous = LeaderboardSnapshot.objects.filter(generation=since).first()
+    return current.generation, sse_event("update", current.diff(previous), current.generation)
+
+
+class GenerationWatcher:
+    """Polls the generation on behalf of every connected client of the process"""
+
+    def __init__(self):
+        self.subscribers: set[asyncio.Queue] = set()
+        self.task: asyncio.Task | None = None
+
+    def subscribe(self) -> asyncio.Queue:
+        queue = asyncio.Queue()
+        self.subscribers.add(queue)
+        if self.task is None or self.task.done():
+            self.task = asyncio.get_running_loop().create_task(self.run())
+        return queue
+
+    def unsubscribe(self, queue: asyncio.Queue):
+        self.subscribers.discard(queue)
+
+    async def run(self):
+        # Stops with the last client, the next one starts it again from the current generation
+        stamp = generation_stamp()
+        generation = await sync_to_async(current_generation)()
+        while self.subscribers:
+            await asyncio.sleep(POLL_INTERVAL)
+            if (new_stamp := generation_stamp()) == stamp:
+                continue
+            stamp = new_stamp
+            try:
+                generation, event = await sync_to_async(compute_update)(generation)
+            except Exception:
+                logger.exception("Could not compute the leaderboard update")
+                continue
+            if event is not None:
+                for queue in self.subscribers:
+                    queue.put_nowait(event)
+
+
+watcher = GenerationWatcher()
+
+
+def allowed_host(scope) -> bool:
+    """The ALLOWED_HOSTS check of Django, for a request that doesn't go through it"""
+    try:
+        ASGIRequest(scope, io.BytesIO()).get_host()
+    except DisallowedHost:
+        return False
+    return True
+
+
+async def respond(send, status: int, headers: list | None = None):
+    await send({"type": "http.response.start", "status": status, "headers": headers or []})
+    await send({"type": "http.response.body", "body": b""})
+
+
+async def wait_for_disconnect(receive):
+    while (await receive())["type"] != "http.disconnect":
+        pass
+
+
+async def live_application(scope, receive, send):
+    if not allowed_host(scope):
+        return await respond(send, 400)
+    if scope["method"] != "GET":
+        return await respond(send, 405, [(b"allow", b"GET")])
+
+    await send(
+        {
+            "type": "http.response.start",
+            "status": 200,
+            "headers": [
+                (b"content-type", b"text/event-stream"),
+                (b"cache-control", b"no-cache"),
+                # Stops nginx from buffering the stream
+                (b"x-accel-buffering", b"no"),
+            ],
+        }
+    )
+    await send(
+        {"type": "http.response.body", "body": f"retry: {RETRY}\n\n".encode(), "more_body": True}
+    )
+
+    queue = watcher.subscribe()
+    disconnected = asyncio.ensure_future(wait_for_disconnect(receive))
+    next_event = asyncio.ensure_future(queue.get())
+    try:
+        while True:
+            done, _ = await asyncio.wait(
+                {disconnected, next_event},
+                timeout=KEEPALIVE_INTERVAL,
+                return_when=asyncio.FIRST_COMPLETED,
+            )
+            if disconnected in done:
+                break
+            if next_event in done:
+                body = next_event.result()
+                next_event = asyncio.ensure_future(queue.get())
+            else:
+                body = b": keep-alive\n\n"
+            await send({"type": "http.response.body", "body": body, "more_body": True})
+    finally:
+        watcher.unsubscribe(queue)
+        disconnected.cancel()
+        next_event.cancel()
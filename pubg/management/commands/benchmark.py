@@ -0,0 +1,246 @@
+import contextlib
+import io
+import json
+import statistics
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+from django.conf import settings
+from django.core.cache import caches
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import Client
+from django.test.utils import (
+    override_settings,
+    setup_databases,
+    setup_test_environment,
+    teardown_databases,
+    teardown_test_environment,
+)
+from django.urls import reverse
+
+from pubg.models import Player, Website
+from pubg.synthetic import populate
+
+
+def quiet(func):
+    """Run func without the output of the commands and progress bars"""
+    with contextlib.redirect_stdout(io.StringIO()), contextlib.redirect_stderr(io.StringIO()):
+        return func()
+
+
+def view(method: str, url: str, data: dict | None = None):
+    def request():
+        response = getattr(Client(), method)(url, data)
+        if response.status_code != 200:
+            raise CommandError(f"{method.upper()} {url} returned {response.status_code}")
+
+    return request
+
+
+@contextlib.contextmanager
+def isolated_page_cache():
+    """
+    Use a temporary page cache and generation stamp file, so that the pages of the
+    synthetic database are never served from, nor written to, the ones of the website
+    """
+    with tempfile.TemporaryDirectory() as directory, override_settings(
+        CACHES={
+            **settings.CACHES,
+            "pages": {**settings.CACHES["pages"], "LOCATION": Path(directory) / "page_cache"},
+        },
+        GENERATION_STAMP_FILE=Path(directory) / "generation",
+    ):
+        Website._cached = None
+        try:
+            yield
+        finally:
+            Website._cached = None
+
+
+def clear_pages():
+    # Otherwise every run after the first one only measures a hit of the page cache
+    caches["pages"].clear()
+
+
+def benchmarks(workers: int) -> dict:
+    """Benchmarks by name, as (function, function to call before each run or None)"""
+    most_sniped = Player.objects.filter(is_forsen=False).order_by("-games_sniped").first()
+    return {
+        "all_rankings_view": (view("get", reverse("index")), clear_pages),
+        "player_view": (view("get", reverse("player_view", args=[most_sniped.id])), clear_pages),
+        "player_search": (
+            view("get", reverse("player_search"), {"player_name": "forsen"}),
+            clear_pages,
+        ),
+        "player_autocomplete": (
+            view("get", reverse("player_autocomplete"), {"q": "forsen"}),
+            None,
+        ),
+        "recompute_player_stats": (
+            lambda: quiet(lambda: call_command("recompute_player_stats")),
+            None,
+        ),
+        "recompute_killscores": (
+            lambda: quiet(lambda: call_command("recompute_killscores")),
+            None,
+        ),
+        "reprocess_telemetry": (
+            lambda: quiet(lambda: call_command("reprocess_telemetry", workers=workers)),
+            None,
+        ),
+    }
+
+
+def measure(func, repeat: int, before=None) -> dict:
+    """
+    Query count and peak Python memory of one run, then median wall time of `repeat` runs
+    Memory is traced in a separate run because tracing slows everything down
+    `before` is called before every run, out of the measurements
+    """
+    before = before or (lambda: None)
+    queries = []
+
+    def count_query(execute, sql, params, many, context):
+        # The query log can't be used: it is cleared at the start of every request
+        queries.append(sql)
+        return execute(sql, params, many, context)
+
+    before()
+    tracemalloc.start()
+    with connection.execute_wrapper(count_query):
+        func()
+    _, peak_memory = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    times = []
+    for _ in range(repeat):
+        before()
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+    return {
+        "queries": len(queries),
+        "time": statistics.median(times),
+        "peak_memory": peak_memory,
+    }
+
+
+class Command(BaseCommand):
+    help = (
+        "Time the views and commands on synthetic databases of several sizes, in a throwaway "
+        "test database, and compare the results with a stored baseline"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--scales",
+            type=int,
+            nargs="+",
+            default=[100, 1000],
+            help="Numbers of matches of the synthetic databases (default: 100 1000). The "
+            "rankings of players with more than 10 kills + deaths are empty below about 30 "
+            "matches, and only have a dozen players at 100",
+        )
+        parser.add_argument(
+            "--players-per-match",
+            type=int,
+            default=10,
+            help="Size of the player pool relative to the number of matches (default: 10)",
+        )
+        parser.add_argument(
+            "--telemetry-events",
+            type=int,
+            default=2000,
+            help="Maximum number of events in the telemetry of a match (default: 2000)",
+        )
+        parser.add_argument(
+            "--only", nargs="+", metavar="BENCHMARK", help="Only run these benchmarks"
+        )
+        parser.add_argument("--repeat", type=int, default=5, help="Timed runs per benchmark")
+        parser.add_argument(
+            "--workers",
+            type=int,
+            default=1,
+            help="Worker processes of reprocess_telemetry (default: 1)",
+        )
+        parser.add_argument(
+            "--baseline",
+            default=settings.BASE_DIR / "benchmark_baseline.json",
+            help="Baseline file (default: benchmark_baseline.json in the project directory)",
+        )
+        parser.add_argument(
+            "--save-baseline",
+            action="store_true",
+            help="Save the results as the new baseline instead of comparing them",
+        )
+        parser.add_argument(
+            "--threshold",
+            type=float,
+            default=1.25,
+            help="Report a regression when time or memory grows by more than this ratio",
+        )
+
+    def handle(self, scales, players_per_match, telemetry_events, only, repeat, workers, **options):
+        results = {}
+        setup_test_environment()
+        try:
+            for scale in scales:
+                old_config = setup_databases(verbosity=0, interactive=False, aliases={"default"})
+                try:
+                    with isolated_page_cache():
+                        print(f"Generating {scale} matches...")
+                        start = time.perf_counter()
+                        quiet(
+                            lambda: populate(
+                                scale * players_per_match, scale, telemetry_events=telemetry_events
+                            )
+                        )
+                        print(f"Generated in {time.perf_counter() - start:.1f}s")
+
+                        for name, (func, before) in benchmarks(workers).items():
+                            if only and name not in only:
+                                continue
+                            result = measure(func, repeat, before)
+                            results[f"{scale} matches/{name}"] = result
+                            print(
+                                f"{scale:>7} matches  {name:<24} {result['queries']:>6} queries"
+                                f"  {result['time'] * 1000:>9.1f} ms"
+                                f"  {result['peak_memory'] / 2**20:>7.1f} MiB"
+                            )
+                finally:
+                    teardown_databases(old_config, verbosity=0)
+        finally:
+            teardown_test_environment()
+
+        if options["save_baseline"]:
+            with open(options["baseline"], "w") as f:
+                json.dump(results, f, indent=2)
+            print(f"Saved the baseline to {options['baseline']}")
+            return
+
+        try:
+            with open(options["baseline"]) as f:
+                baseline = json.load(f)
+        except FileNotFoundError:
+            print("No baseline to compare with, save one with --save-baseline")
+            return
+        self.compare(results, baseline, options["threshold"])
+
+    def compare(self, results: dict, baseline: dict, threshold: float):
+        regressions = []
+        for key, result in results.items():
+            if (old := baseline.get(key)) is None:
+                continue
+            if result["queries"] > old["queries"]:
+                regressions.append(f"{key}: {old['queries']} -> {result['queries']} queries")
+            for metric in ("time", "peak_memory"):
+                if result[metric] > old[metric] * threshold:
+                    ratio = result[metric] / old[metric]
+                    regressions.append(f"{key}: {metric} is {ratio:.2f}x the baseline")
+
+        if regressions:
+            raise CommandError("Regressions compared to the baseline:\n" + "\n".join(regressions))
+        print(f"No regression compared to the baseline ({len(baseline)} benchmarks)")
@@ -0,0 +1,56 @@
+import signal
+import sys
+from django.core.management.base import BaseCommand
+
+from pubg.fakeapi import API_PREFIX, FakeAPIServer, FixtureStore
+
+
+class Command(BaseCommand):
+    help = "Serve recorded PUBG API responses locally, with optional latency and failures"
+
+    def add_arguments(self, parser):
+        parser.add_argument("fixtures", help="Fixtures directory, see record_api_fixtures")
+        parser.add_argument("--host", default="127.0.0.1")
+        parser.add_argument("--port", type=int, default=8001)
+        parser.add_argument(
+            "--latency", type=float, default=0, help="Delay of every response in seconds"
+        )
+        parser.add_argument(
+            "--jitter", type=float, default=0, help="Random variation of the delay in seconds"
+        )
+        parser.add_argument(
+            "--error-rate", type=float, default=0, help="Fraction of requests failing with a 500"
+        )
+        parser.add_argument(
+            "--throttle-rate",
+            type=float,
+            default=0,
+            help="Fraction of requests rate limited with a 429",
+        )
+        parser.add_argument(
+            "--retry-after", type=int, default=1, help="Retry-After of 429 responses in seconds"
+        )
+        parser.add_argument("--seed", type=int, help="Seed of the failures and jitter")
+
+    def handle(self, fixtures, host, port, **options):
+        server = FakeAPIServer(
+            (host, port),
+            FixtureStore(fixtures),
+            latency=options["latency"],
+            jitter=options["jitter"],
+            error_rate=options["error_rate"],
+            throttle_rate=options["throttle_rate"],
+            retry_after=options["retry_after"],
+            seed=options["seed"],
+        )
+        print(f"PUBG_API_URL=http://{host}:{port}{API_PREFIX}")
+        print(f"PUBG_TELEMETRY_URL=http://{host}:{port}")
+        # Also print the summary when stopped by a benchmark script
+        signal.signal(signal.SIGTERM, lambda *_: sys.exit())
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
+            print(f"Responses by status: {server.counts}")
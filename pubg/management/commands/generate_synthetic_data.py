@@ -0,0 +1,39 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from pubg.models import Match
+from pubg.synthetic import populate
+
+
+class Command(BaseCommand):
+    help = "Fill the database with synthetic players, matches and telemetry"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--players", type=int, default=5000, help="Size of the player pool")
+        parser.add_argument("--matches", type=int, default=500, help="Number of matches")
+        parser.add_argument("--seed", type=int, default=0)
+        parser.add_argument(
+            "--telemetry-events",
+            type=int,
+            default=2000,
+            help="Maximum number of events in the telemetry of a match (default: 2000)",
+        )
+        parser.add_argument("--no-telemetry", action="store_true", help="Don't generate telemetry")
+        parser.add_argument(
+            "--force",
+            action="store_true",
+            help="Add synthetic matches even if the database already has matches",
+        )
+
+    def handle(self, players, matches, seed, telemetry_events, no_telemetry, force, **_):
+        if Match.objects.exists() and not force:
+            raise CommandError("The database already has matches, use --force to add more")
+        print(f"Generating {matches} matches with a pool of {players} players...")
+        match_ids = populate(
+            players,
+            matches,
+            seed=seed,
+            telemetry_events=telemetry_events,
+            with_telemetry=not no_telemetry,
+            progress=True,
+        )
+        print(f"Generated {len(match_ids)} matches")
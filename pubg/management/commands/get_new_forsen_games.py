@@ -2,10 +2,9 @@ import datetime
 import logging
 import sys
 from django.core.management.base import BaseCommand
-from django.utils import timezone
-from tqdm import tqdm
 
-from pubg.models import Player, PlayerMatchStats, Match, Website
+from pubg.ingest import run_jobs
+from pubg.models import IngestJob, Player, Website
 from pubg import FORSEN_PLAYERID
 
 logger = logging.getLogger(__name__)
@@ -17,30 +16,24 @@ logger.addHandler(stdout_handler)
 
 
 class Command(BaseCommand):
-    def handle(self, **_):
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--workers",
+            type=int,
+            default=4,
+            help="Number of matches downloaded concurrently (default: 4)",
+        )
+
+    def handle(self, workers, **_):
         forsen = Player.objects.get(id=FORSEN_PLAYERID)
         forsen.update_from_api()
 
-        logger.info("Getting info from new games...")
-        new_matches = Match.objects.filter(created_at__isnull=True)
-        new_match_ids = []
+        nb_new_matches = IngestJob.enqueue_new_matches()
+        logger.info(f"Getting info from {nb_new_matches} new games...")
+        # Also retries jobs from previous runs that are due, e.g. failed telemetry downloads
+        ingested_match_ids = run_jobs(workers)
+        logger.info(f"Got info from {len(ingested_match_ids)} games")
 
-        for match in tqdm(new_matches):
-            match.update_from_api()
-            new_match_ids.append(match.id)
-        logger.info(f"Got info from {len(new_matches)} new games")
-
-        print(f"Recomputing player stats...")
-        players_to_update_list = (
-            PlayerMatchStats.objects.filter(match__in=new_match_ids)
-            .values_list("player", flat=True)
-            .distinct()
-        )
-        players_to_update = Player.objects.filter(id__in=players_to_update_list)
-        for player in tqdm(players_to_update):
-            player.compute_stats()
-        logger.info(f"Recomputed stats for {len(players_to_update)} players")
-
-        website, _ = Website.objects.get_or_create(pk=1)
-        website.last_update = timezone.now()
-        website.save()
+        # A new generation invalidates every cached page and notifies the live clients
+        if ingested_match_ids:
+            Website.publish()
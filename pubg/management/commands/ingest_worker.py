@@ -0,0 +1,42 @@
+import logging
+import sys
+import time
+from django.core.management.base import BaseCommand
+
+from pubg.ingest import run_jobs
+from pubg.models import IngestJob, Website
+
+logger = logging.getLogger("pubg.ingest")
+logger.setLevel(logging.DEBUG)
+
+stdout_handler = logging.StreamHandler(sys.stdout)
+stdout_handler.setLevel(logging.INFO)
+logger.addHandler(stdout_handler)
+
+
+class Command(BaseCommand):
+    help = "Process pending ingestion jobs, several workers can run at the same time"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--workers",
+            type=int,
+            default=4,
+            help="Number of matches downloaded concurrently (default: 4)",
+        )
+        parser.add_argument(
+            "--poll",
+            type=float,
+            help="Keep running and look for due jobs every POLL seconds",
+        )
+
+    def handle(self, workers, poll, **_):
+        while True:
+            IngestJob.enqueue_new_matches()
+            ingested_match_ids = run_jobs(workers)
+            if ingested_match_ids:
+                logger.info(f"Processed ingestion jobs of {len(ingested_match_ids)} matches")
+                Website.publish()
+            if poll is None:
+                break
+            time.sleep(poll)
@@ -0,0 +1,94 @@
+import random
+import time
+from django.core.management.base import BaseCommand, CommandError
+from tqdm import tqdm
+
+import pubg.compression
+from pubg.models import MatchTelemetry, TelemetryDictionary
+
+SAMPLE_SIZE = 64 * 1024
+
+
+class Command(BaseCommand):
+    help = "Recompress the stored telemetry with another codec and report size and speed gains"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--codec", choices=("gzip", "zstd"), default="zstd")
+        parser.add_argument("--level", type=int, default=12, help="zstd compression level")
+        parser.add_argument(
+            "--train",
+            action="store_true",
+            help="Train a new zstd dictionary on the stored telemetry first",
+        )
+        parser.add_argument(
+            "--dict-size", type=int, default=112640, help="Size of the trained dictionary in bytes"
+        )
+        parser.add_argument(
+            "--samples", type=int, default=100, help="Number of matches to train the dictionary on"
+        )
+        parser.add_argument(
+            "--dry-run", action="store_true", help="Only report the gains, don't rewrite anything"
+        )
+
+    def train(self, match_ids: list[str], nb_samples: int, dict_size: int) -> tuple[int, bytes]:
+        # zstd recommends about 100 times the dictionary size in samples
+        sampled_ids = random.sample(match_ids, min(nb_samples, len(match_ids)))
+        slices_per_match = max(1, 100 * dict_size // (len(sampled_ids) * SAMPLE_SIZE))
+        samples = []
+        print(f"Training a {dict_size} bytes dictionary on {len(sampled_ids)} matches...")
+        for match_id in tqdm(sampled_ids):
+            data = pubg.compression.open_blob(MatchTelemetry.load(match_id)).read()
+            for _ in range(slices_per_match):
+                start = random.randrange(max(1, len(data) - SAMPLE_SIZE))
+                samples.append(data[start : start + SAMPLE_SIZE])
+        dict_id, dictionary = pubg.compression.train_dictionary(samples, dict_size)
+        pubg.compression.register_dictionary(dict_id, dictionary)
+        print(f"Trained dictionary {dict_id}")
+        return dict_id, dictionary
+
+    def handle(self, codec, level, train, dict_size, samples, dry_run, **_):
+        match_ids = list(MatchTelemetry.objects.values_list("match_id", flat=True))
+        if not match_ids:
+            raise CommandError("There is no stored telemetry")
+
+        try:
+            if codec == "gzip":
+                if train:
+                    raise CommandError("Only zstd can use a dictionary")
+                new_codec = pubg.compression.get_codec("gzip")
+            elif train:
+                dict_id, dictionary = self.train(match_ids, samples, dict_size)
+                if not dry_run:
+                    TelemetryDictionary.objects.create(id=dict_id, data=dictionary)
+                new_codec = pubg.compression.get_codec("zstd", dictionary=dictionary, level=level)
+            else:
+                new_codec = pubg.compression.get_codec("zstd", level=level)
+        except pubg.compression.CodecError as e:
+            raise CommandError(e)
+
+        old_size = new_size = 0
+        old_time = new_time = 0.0
+        print(f"{'Measuring' if dry_run else 'Recompressing'} {len(match_ids)} matches...")
+        for match_id in tqdm(match_ids):
+            old_blob = MatchTelemetry.load(match_id)
+            start = time.perf_counter()
+            data = pubg.compression.open_blob(old_blob).read()
+            old_time += time.perf_counter() - start
+
+            new_blob = new_codec.compress(data)
+            start = time.perf_counter()
+            if pubg.compression.open_blob(new_blob).read() != data:
+                raise CommandError(f"Recompressed telemetry of match {match_id} is corrupted")
+            new_time += time.perf_counter() - start
+
+            old_size += len(old_blob)
+            new_size += len(new_blob)
+            if not dry_run:
+                MatchTelemetry.objects.filter(match_id=match_id).update(data=new_blob)
+
+        mb = 1024 * 1024
+        print(f"Size: {old_size / mb:.1f} MB -> {new_size / mb:.1f} MB ({new_size / old_size:.1%})")
+        print(
+            f"Decompression time: {old_time:.2f} s -> {new_time:.2f} s "
+            f"({old_time / max(new_time, 1e-9):.1f}x faster)"
+        )
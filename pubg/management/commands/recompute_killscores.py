@@ -1,18 +1,13 @@
 from django.core.management.base import BaseCommand
-from tqdm import tqdm
 
-from pubg.models import Player, PlayerMatchStats
+from pubg.models import Player, PlayerMatchStats, Website
 
 
 class Command(BaseCommand):
     def handle(self, **_):
-        pms_with_forsen_kills = PlayerMatchStats.objects.filter(
-            killed_forsen_with__isnull=False, forsen_final_rank__isnull=False
-        )
         print("Recomputing match killscores...")
-        for pms in tqdm(pms_with_forsen_kills):
-            pms.killscore = pms.compute_killscore()
-            pms.save()
+        nb_kills = PlayerMatchStats.objects.compute_killscores()
+        print(f"Recomputed {nb_kills} killscores")
         print("Recomputing player killscores...")
-        for player in tqdm(Player.objects.all()):
-            player.compute_stats()
+        Player.objects.compute_stats()
+        Website.publish()
@@ -1,10 +1,11 @@
 from django.core.management.base import BaseCommand
-from tqdm import tqdm
 
-from pubg.models import Player
+from pubg.models import Player, Website
 
 
 class Command(BaseCommand):
     def handle(self, **_):
-        for player in tqdm(Player.objects.all()):
-            player.compute_stats()
+        nb_updated_players = Player.objects.compute_stats()
+        print(f"Updated stats of {nb_updated_players} players")
+        if nb_updated_players:
+            Website.publish()
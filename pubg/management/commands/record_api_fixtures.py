@@ -0,0 +1,68 @@
+from django.core.management.base import BaseCommand
+from tqdm import tqdm
+
+import pubg.api
+from pubg import FORSEN_PLAYERID
+from pubg.fakeapi import FixtureStore
+from pubg.models import Match
+
+
+class Command(BaseCommand):
+    help = "Record responses of the PUBG API into a fixtures directory for pubg.fakeapi"
+
+    def add_arguments(self, parser):
+        parser.add_argument("fixtures", help="Fixtures directory")
+        parser.add_argument(
+            "match_ids", nargs="*", help="Record these matches instead of forsen's last ones"
+        )
+        parser.add_argument(
+            "--matches",
+            type=int,
+            default=20,
+            help="Number of forsen's most recent matches to record (default: 20)",
+        )
+        parser.add_argument(
+            "--players",
+            action="store_true",
+            help="Also record the players of every match, in batches of "
+            f"{pubg.api.PLAYERS_PER_REQUEST}",
+        )
+
+    def handle(self, fixtures, match_ids, matches, players, **_):
+        store = FixtureStore(fixtures)
+        forsen_info = pubg.api.get_player_info(FORSEN_PLAYERID)
+        forsen_matches = forsen_info["data"]["relationships"]["matches"]
+        if not match_ids:
+            match_ids = [
+                match_data["id"]
+                for match_data in forsen_matches["data"]
+                if match_data["type"] == "match"
+            ][:matches]
+        # Only list the recorded matches, the others would be 404s when replayed
+        forsen_matches["data"] = [
+            match_data for match_data in forsen_matches["data"] if match_data["id"] in match_ids
+        ]
+        store.save_player(forsen_info)
+
+        player_ids = set()
+        print(f"Recording {len(match_ids)} matches...")
+        for match_id in tqdm(match_ids):
+            match_info = pubg.api.get_match_info(match_id)
+            store.save_match(match_id, match_info)
+            if telemetry_url := Match.get_telemetry_url(match_info):
+                store.save_telemetry(telemetry_url, pubg.api.get_telemetry_data(telemetry_url))
+            for entry in match_info["included"]:
+                if entry["type"] == "participant":
+                    player_id = entry["attributes"]["stats"]["playerId"]
+                    if not player_id.startswith(("ai.", "npc.")):
+                        player_ids.add(player_id)
+
+        if players:
+            player_ids = sorted(player_ids - {FORSEN_PLAYERID})
+            print(f"Recording {len(player_ids)} players...")
+            batches = range(0, len(player_ids), pubg.api.PLAYERS_PER_REQUEST)
+            for i in tqdm(batches):
+                batch = player_ids[i : i + pubg.api.PLAYERS_PER_REQUEST]
+                for player_info in pubg.api.get_players_info(batch):
+                    store.save_player(player_info)
+        print(f"Recorded fixtures in {fixtures}")
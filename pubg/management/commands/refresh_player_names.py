@@ -0,0 +1,63 @@
+import datetime
+import logging
+import sys
+import time
+from django.core.management.base import BaseCommand
+from tqdm import tqdm
+
+import pubg.api
+from pubg.api import APIError
+from pubg.models import Player, Website
+
+logger = logging.getLogger("pubg.models")
+logger.setLevel(logging.DEBUG)
+
+stdout_handler = logging.StreamHandler(sys.stdout)
+stdout_handler.setLevel(logging.INFO)
+logger.addHandler(stdout_handler)
+
+
+class Command(BaseCommand):
+    help = (
+        "Refresh the names of players whose name was not checked recently, "
+        f"{pubg.api.PLAYERS_PER_REQUEST} players per API request"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--days",
+            type=float,
+            default=30,
+            help="Refresh names that were not checked for this many days (default: 30)",
+        )
+        parser.add_argument("--limit", type=int, help="Refresh at most this many players")
+        parser.add_argument(
+            "--rpm",
+            type=float,
+            default=10,
+            help="Maximum number of API requests per minute (default: 10)",
+        )
+
+    def handle(self, days, limit, rpm, **_):
+        players = Player.objects.filter(is_forsen=False).with_stale_names(
+            datetime.timedelta(days=days)
+        )
+        player_ids = list(players.values_list("id", flat=True)[:limit])
+        print(f"Refreshing names of {len(player_ids)} players...")
+
+        interval = 60 / rpm
+        next_request_at = time.monotonic()
+        nb_renamed = 0
+        for i in tqdm(range(0, len(player_ids), pubg.api.PLAYERS_PER_REQUEST)):
+            time.sleep(max(next_request_at - time.monotonic(), 0))
+            next_request_at = time.monotonic() + interval
+            batch = player_ids[i : i + pubg.api.PLAYERS_PER_REQUEST]
+            try:
+                nb_renamed += Player.objects.filter(id__in=batch).update_names_from_api()
+            except APIError as e:
+                # Names that were not refreshed are still stale and will be picked up next time
+                tqdm.write(f"Could not get player info: {e}")
+                break
+        print(f"{nb_renamed} players were renamed")
+        if nb_renamed:
+            Website.publish()
@@ -0,0 +1,160 @@
+import logging
+import multiprocessing
+import os
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from dateutil.parser import isoparse
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from tqdm import tqdm
+
+import pubg.compression
+import pubg.telemetry
+from pubg.models import (
+    Match,
+    MatchTelemetry,
+    Player,
+    PlayerMatchStats,
+    TelemetryDictionary,
+    Website,
+)
+
+logger = logging.getLogger(__name__)
+
+MATCH_FIELDS = (
+    "forsen_died_to_cause",
+    "forsen_died_to_account",
+    "forsen_final_rank",
+    "nb_forsen_kills",
+    "nb_forsen_bot_kills",
+)
+PLAYER_MATCH_STATS_FIELDS = (
+    "damage_to_forsen",
+    "killed_forsen_with",
+    "killed_by_forsen_with",
+    "forsen_final_rank",
+    "killscore",
+)
+
+
+def snapshot(match: Match) -> dict:
+    stats = {"match": {field: getattr(match, field) for field in MATCH_FIELDS}}
+    for player_match_stats in PlayerMatchStats.objects.filter(match=match):
+        stats[player_match_stats.player_id] = {
+            field: getattr(player_match_stats, field) for field in PLAYER_MATCH_STATS_FIELDS
+        }
+    return stats
+
+
+class Command(BaseCommand):
+    help = (
+        "Re-extract the stats of matches from their stored telemetry using a process pool, "
+        "or recompute them from the stored forsen events"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("match_ids", nargs="*", help="Only reprocess these matches")
+        parser.add_argument("--since", type=isoparse, help="Only matches created after this date")
+        parser.add_argument("--until", type=isoparse, help="Only matches created before this date")
+        parser.add_argument(
+            "--workers",
+            type=int,
+            default=os.cpu_count(),
+            help="Number of worker processes (default: number of CPUs)",
+        )
+        parser.add_argument(
+            "--from-events",
+            action="store_true",
+            help="Recompute the stats from the stored forsen events instead of the telemetry",
+        )
+        parser.add_argument(
+            "--dry-run",
+            action="store_true",
+            help="Print what would change instead of writing it",
+        )
+
+    def handle(self, match_ids, since, until, workers, from_events, dry_run, **_):
+        if from_events:
+            # Matches ingested before the events table existed have no events yet
+            matches = Match.objects.filter(forsen_events__isnull=False).distinct()
+        else:
+            matches = Match.objects.filter(telemetry__isnull=False)
+        if match_ids:
+            matches = matches.filter(id__in=match_ids)
+        if since:
+            matches = matches.filter(created_at__gte=since)
+        if until:
+            matches = matches.filter(created_at__lte=until)
+        matches = {match.id: match for match in matches}
+
+        print(f"Reprocessing {len(matches)} matches...")
+        if from_events:
+            changed_matches = [
+                match.id
+                for match in tqdm(matches.values())
+                if self.apply(match, match.forsen_events_stats(), dry_run, save_events=False)
+            ]
+        else:
+            changed_matches = self.reprocess_telemetry(matches, workers, dry_run)
+
+        print(f"{len(changed_matches)} matches {'would change' if dry_run else 'changed'}")
+        if changed_matches and not dry_run:
+            print("Recomputing player stats...")
+            players = Player.objects.filter(playermatchstats__match__in=changed_matches)
+            Player.objects.filter(id__in=players.values("id")).compute_stats()
+            Website.publish()
+
+    def reprocess_telemetry(self, matches: dict, workers: int, dry_run: bool) -> list[str]:
+        dictionaries = dict(TelemetryDictionary.objects.values_list("id", "data"))
+        dictionaries = {dict_id: bytes(data) for dict_id, data in dictionaries.items()}
+
+        changed_matches = []
+        # Spawned workers start from a fresh interpreter: unlike forked ones, they can't inherit
+        # the database connection, whenever the blobs are read here. They only need the
+        # dictionaries, not Django.
+        with ProcessPoolExecutor(
+            max_workers=max(workers, 1),
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=pubg.compression.register_dictionaries if dictionaries else None,
+            initargs=(dictionaries,) if dictionaries else (),
+        ) as executor, tqdm(total=len(matches)) as progress:
+            # Workers decompress and parse, results are applied here by a single writer
+            pending = {}
+            to_submit = iter(matches)
+            while True:
+                for match_id in to_submit:
+                    blob = MatchTelemetry.load(match_id)
+                    future = executor.submit(pubg.telemetry.extract_stats_from_blob, blob)
+                    pending[future] = match_id
+                    if len(pending) >= 2 * workers:
+                        break
+                if not pending:
+                    break
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    match_id = pending.pop(future)
+                    progress.update()
+                    try:
+                        stats = future.result()
+                    except Exception:
+                        # A corrupt blob must not stop the reprocessing of the other matches
+                        logger.exception(f"Could not reprocess the telemetry of match {match_id}")
+                        continue
+                    if self.apply(matches[match_id], stats, dry_run):
+                        changed_matches.append(match_id)
+        return changed_matches
+
+    def apply(self, match: Match, stats, dry_run: bool, save_events=True) -> bool:
+        """Apply the stats of a match, returns whether anything changed"""
+        with transaction.atomic():
+            before = snapshot(match)
+            match.apply_telemetry_stats(stats, save_events=save_events)
+            after = snapshot(match)
+            if dry_run:
+                transaction.set_rollback(True)
+
+        if dry_run:
+            for key, values in after.items():
+                for field, value in values.items():
+                    if (old_value := before.get(key, {}).get(field)) != value:
+                        tqdm.write(f"{match.id} {key} {field}: {old_value} -> {value}")
+        return before != after
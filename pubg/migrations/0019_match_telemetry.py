@@ -0,0 +1,53 @@
+# Generated by Django 4.0.4 on 2026-10-18 11:26
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def move_telemetry_to_table(apps, schema_editor):
+    Match = apps.get_model("pubg", "Match")
+    MatchTelemetry = apps.get_model("pubg", "MatchTelemetry")
+    matches = Match.objects.filter(telemetry_data_gz__isnull=False).values_list(
+        "id", "telemetry_data_gz"
+    )
+    for match_id, data_gz in matches.iterator(chunk_size=100):
+        MatchTelemetry.objects.create(match_id=match_id, data_gz=data_gz)
+
+
+def move_telemetry_to_match(apps, schema_editor):
+    Match = apps.get_model("pubg", "Match")
+    MatchTelemetry = apps.get_model("pubg", "MatchTelemetry")
+    telemetries = MatchTelemetry.objects.values_list("match_id", "data_gz")
+    for match_id, data_gz in telemetries.iterator(chunk_size=100):
+        Match.objects.filter(id=match_id).update(telemetry_data_gz=data_gz)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("pubg", "0018_player_pubg_player_name_f5804c_idx"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="MatchTelemetry",
+            fields=[
+                (
+                    "match",
+                    models.OneToOneField(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        primary_key=True,
+                        related_name="telemetry",
+                        serialize=False,
+                        to="pubg.match",
+                    ),
+                ),
+                ("data_gz", models.BinaryField(verbose_name="Telemetry Data")),
+            ],
+        ),
+        migrations.RunPython(move_telemetry_to_table, move_telemetry_to_match),
+        migrations.RemoveField(
+            model_name="match",
+            name="telemetry_data_gz",
+        ),
+    ]
@@ -0,0 +1,26 @@
+# Generated by Django 4.0.4 on 2026-10-18 11:27
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("pubg", "0019_match_telemetry"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="TelemetryDictionary",
+            fields=[
+                ("id", models.PositiveIntegerField(primary_key=True, serialize=False)),
+                ("data", models.BinaryField()),
+                ("created_at", models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.RenameField(
+            model_name="matchtelemetry",
+            old_name="data_gz",
+            new_name="data",
+        ),
+    ]
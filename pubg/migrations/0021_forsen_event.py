@@ -0,0 +1,56 @@
+# Generated by Django 4.0.4 on 2026-10-18 11:33
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("pubg", "0020_telemetry_dictionary"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="ForsenEvent",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True, primary_key=True, serialize=False, verbose_name="ID"
+                    ),
+                ),
+                ("index", models.IntegerField()),
+                ("type", models.CharField(max_length=32)),
+                ("timestamp", models.DateTimeField(null=True)),
+                ("account_id", models.CharField(max_length=64, null=True)),
+                ("victim_account_id", models.CharField(max_length=64, null=True)),
+                ("damage", models.FloatField(null=True)),
+                ("damage_type_category", models.CharField(max_length=64, null=True)),
+                ("rank", models.IntegerField(null=True)),
+                ("is_suicide", models.BooleanField(default=False)),
+                (
+                    "match",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="forsen_events",
+                        to="pubg.match",
+                    ),
+                ),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name="forsenevent",
+            index=models.Index(fields=["type", "account_id"], name="pubg_forsen_type_c416dd_idx"),
+        ),
+        migrations.AddIndex(
+            model_name="forsenevent",
+            index=models.Index(
+                fields=["type", "victim_account_id"], name="pubg_forsen_type_9b2bf0_idx"
+            ),
+        ),
+        migrations.AlterUniqueTogether(
+            name="forsenevent",
+            unique_together={("match", "index")},
+        ),
+    ]
@@ -0,0 +1,46 @@
+# Generated by Django 4.0.4 on 2026-10-18 11:35
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("pubg", "0021_forsen_event"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="IngestJob",
+            fields=[
+                (
+                    "match",
+                    models.OneToOneField(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        primary_key=True,
+                        related_name="ingest_job",
+                        serialize=False,
+                        to="pubg.match",
+                    ),
+                ),
+                ("state", models.CharField(default="pending", max_length=16)),
+                ("stage", models.CharField(default="match", max_length=16)),
+                ("attempts", models.IntegerField(default=0)),
+                ("next_attempt_at", models.DateTimeField(default=django.utils.timezone.now)),
+                ("leased_by", models.CharField(max_length=64, null=True)),
+                ("lease_expires_at", models.DateTimeField(null=True)),
+                ("telemetry_url", models.CharField(max_length=512, null=True)),
+                ("last_error", models.TextField(null=True)),
+                ("created_at", models.DateTimeField(auto_now_add=True)),
+                ("updated_at", models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name="ingestjob",
+            index=models.Index(
+                fields=["state", "next_attempt_at"], name="pubg_ingest_state_90e5cb_idx"
+            ),
+        ),
+    ]
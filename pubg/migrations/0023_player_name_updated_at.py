@@ -0,0 +1,22 @@
+# Generated by Django 4.0.4 on 2026-10-18 11:37
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("pubg", "0022_ingest_job"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="player",
+            name="name_updated_at",
+            field=models.DateTimeField(null=True),
+        ),
+        migrations.AddIndex(
+            model_name="player",
+            index=models.Index(fields=["name_updated_at"], name="pubg_player_name_up_31e927_idx"),
+        ),
+    ]
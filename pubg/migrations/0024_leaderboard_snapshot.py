@@ -0,0 +1,32 @@
+# Generated by Django 4.0.4 on 2026-10-18 12:41
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("pubg", "0023_player_name_updated_at"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="LeaderboardSnapshot",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True, primary_key=True, serialize=False, verbose_name="ID"
+                    ),
+                ),
+                ("generation", models.IntegerField(unique=True)),
+                ("created_at", models.DateTimeField(auto_now_add=True)),
+                ("data", models.JSONField()),
+            ],
+        ),
+        migrations.AddField(
+            model_name="website",
+            name="generation",
+            field=models.IntegerField(default=0),
+        ),
+    ]
@@ -0,0 +1,52 @@
+# Generated by Django 4.0.4 on 2026-10-18 11:55
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def index_player_names(apps, schema_editor):
+    Player = apps.get_model("pubg", "Player")
+    PlayerNameTrigram = apps.get_model("pubg", "PlayerNameTrigram")
+    trigrams = []
+    for player_id, name in Player.objects.values_list("id", "name").iterator(chunk_size=1000):
+        name = name.lower()
+        for trigram in {name[i : i + 3] for i in range(len(name) - 2)}:
+            trigrams.append(PlayerNameTrigram(player_id=player_id, trigram=trigram))
+    PlayerNameTrigram.objects.bulk_create(trigrams, batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("pubg", "0024_leaderboard_snapshot"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="PlayerNameTrigram",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True, primary_key=True, serialize=False, verbose_name="ID"
+                    ),
+                ),
+                ("trigram", models.CharField(max_length=3)),
+                (
+                    "player",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="name_trigrams",
+                        to="pubg.player",
+                    ),
+                ),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name="playernametrigram",
+            constraint=models.UniqueConstraint(
+                fields=("trigram", "player"), name="unique_name_trigram"
+            ),
+        ),
+        migrations.RunPython(index_player_names, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,106 @@
+# Generated by Django 4.0.4 on 2026-10-18 11:57
+
+from django.db import migrations, models
+from django.db.models import Case, ExpressionWrapper, F, FloatField, When
+
+
+def compute_ratios(apps, schema_editor):
+    Player = apps.get_model("pubg", "Player")
+
+    def ratio(numerator: str, denominator: str):
+        return Case(
+            When(**{denominator: 0}, then=0.0),
+            default=ExpressionWrapper(
+                F(numerator) * 1.0 / F(denominator), output_field=FloatField()
+            ),
+        )
+
+    Player.objects.update(
+        kd=ratio("kills", "deaths"),
+        dpg=ratio("deaths", "games_sniped"),
+        kpg=ratio("kills", "games_sniped"),
+        eligible=Case(When(kills__gt=10 - F("deaths"), then=True), default=False),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("pubg", "0025_player_name_trigram"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="player",
+            name="dpg",
+            field=models.FloatField(default=0),
+        ),
+        migrations.AddField(
+            model_name="player",
+            name="eligible",
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AddField(
+            model_name="player",
+            name="kd",
+            field=models.FloatField(default=0),
+        ),
+        migrations.AddField(
+            model_name="player",
+            name="kpg",
+            field=models.FloatField(default=0),
+        ),
+        migrations.RunPython(compute_ratios, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name="player",
+            index=models.Index(fields=["killscore", "id"], name="player_killscore_idx"),
+        ),
+        migrations.AddIndex(
+            model_name="player",
+            index=models.Index(fields=["kills", "id"], name="player_kills_idx"),
+        ),
+        migrations.AddIndex(
+            model_name="player",
+            index=models.Index(
+                condition=models.Q(("eligible", True)),
+                fields=["-kd", "-deaths", "-id"],
+                name="player_best_kd_idx",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="player",
+            index=models.Index(
+                condition=models.Q(("eligible", True)),
+                fields=["kd", "-deaths", "-id"],
+                name="player_worst_kd_idx",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="player",
+            index=models.Index(
+                condition=models.Q(("eligible", True)), fields=["dpg", "id"], name="player_dpg_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="player",
+            index=models.Index(
+                condition=models.Q(("eligible", True)), fields=["kpg", "id"], name="player_kpg_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="player",
+            index=models.Index(
+                condition=models.Q(("eligible", True)),
+                fields=["deaths", "id"],
+                name="player_deaths_idx",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="player",
+            index=models.Index(
+                condition=models.Q(("eligible", True)),
+                fields=["games_sniped", "id"],
+                name="player_games_idx",
+            ),
+        ),
+    ]
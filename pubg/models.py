@@ -1,20 +1,255 @@
 from dateutil.parser import isoparse
-from django.db import models
+from django.conf import settings
+from django.db import models, transaction
+from django.db.models import Case, Count, F, Q, Sum, Value, When
+from django.db.models.functions import Cast, Coalesce, Ln
+from django.utils import timezone
 from math import log
 import datetime
-import gzip
-import json
+import io
 import logging
+import os
 
 import pubg.api
-from pubg import FORSEN_PLAYERID, WEAPON_KILLSCORE_MULTIPLIERS
+import pubg.compression
+import pubg.telemetry
+from pubg import (
+    FORSEN_PLAYERID,
+    KILLSCORE_TABLE_WEAPONS,
+    WEAPON_KILLSCORE_MULTIPLIERS,
+    WEAPON_NAMES,
+)
 
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.DEBUG)
 
 
+def generation_stamp() -> tuple[int, int] | None:
+    """
+    Version of the generation stamp file touched by Website.publish(), None until the first
+    publish. Only a stat(), so it can be polled often, including from async code
+    """
+    try:
+        stat = os.stat(settings.GENERATION_STAMP_FILE)
+    except FileNotFoundError:
+        return None
+    return stat.st_ino, stat.st_mtime_ns
+
+
 class Website(models.Model):
     last_update = models.DateTimeField(default=datetime.datetime(2022, 1, 1))
+    # Incremented every time the stats change and a new LeaderboardSnapshot is published
+    generation = models.IntegerField(default=0)
+
+    # (stamp file version, website) of the last read, see cached()
+    _cached = None
+
+    @classmethod
+    def cached(cls) -> "Website":
+        """
+        The website row as of the last publish(), kept in memory by each process
+        Checking the generation stamp file costs a stat() instead of a query
+        """
+        stamp = generation_stamp()
+        # Until something is published with this stamp file, it can't tell when to reload
+        if stamp is None or cls._cached is None or cls._cached[0] != stamp:
+            cls._cached = (stamp, cls.objects.filter(pk=1).first() or cls(pk=1))
+        return cls._cached[1]
+
+    @property
+    def version(self) -> str:
+        """
+        Identifies a publish() even across databases: the generation restarts with a new
+        database, the time of the publish doesn't
+        """
+        return f"{self.generation}-{int(self.last_update.timestamp() * 1e6)}"
+
+    @staticmethod
+    def touch_generation_stamp(generation: int):
+        # Replaced rather than rewritten, so that its inode changes even if the mtime doesn't
+        path = settings.GENERATION_STAMP_FILE
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w") as f:
+            f.write(f"{generation}\n")
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def publish(cls) -> int:
+        """
+        Start a new generation with a snapshot of the current leaderboards
+        Must be called after anything that changes the stats, returns the new generation
+        """
+        with transaction.atomic():
+            website, _ = cls.objects.select_for_update().get_or_create(pk=1)
+            website.generation += 1
+            website.last_update = timezone.now()
+            LeaderboardSnapshot.objects.create(
+                generation=website.generation, data=LeaderboardSnapshot.compute()
+            )
+            website.save()
+            transaction.on_commit(lambda: cls.touch_generation_stamp(website.generation))
+        LeaderboardSnapshot.objects.filter(
+            generation__lte=website.generation - LeaderboardSnapshot.KEEP
+        ).delete()
+        return website.generation
+
+
+class LeaderboardSnapshot(models.Model):
+    """
+    The rankings page, precomputed for one generation: the top rows of every ranking and
+    the match count and dates, so that the page doesn't depend on the size of the tables
+    """
+
+    # Rankings of the page: ordering, and whether only players with more than 10 kills +
+    # deaths are ranked. The ID makes every ordering total, for the keyset pagination of the
+    # API, and each ordering has an index (see Player.Meta.indexes)
+    RANKINGS = {
+        "killscore": (("-killscore", "-id"), False),
+        "best_kd": (("-kd", "-deaths", "-id"), True),
+        "worst_kd": (("kd", "-deaths", "-id"), True),
+        "most_kills": (("-kills", "-id"), False),
+        "most_kills_per_game": (("-kpg", "-id"), True),
+        "least_deaths_per_game": (("dpg", "id"), True),
+        "most_deaths_per_game": (("-dpg", "-id"), True),
+        "most_deaths": (("-deaths", "-id"), True),
+        "most_games": (("-games_sniped", "-id"), True),
+    }
+    ROWS_PER_RANKING = 25
+    # Maximum number of new kills in a diff()
+    DIFF_KILLS = 100
+    PLAYER_FIELDS = ("id", "name", "is_forsen", "kills", "deaths", "games_sniped", "killscore")
+    # Number of snapshots kept, older generations are deleted
+    KEEP = 3
+
+    generation = models.IntegerField(unique=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    data = models.JSONField()
+
+    def __str__(self):
+        return f"Generation {self.generation}"
+
+    @classmethod
+    def current(cls) -> "LeaderboardSnapshot | None":
+        return cls.objects.order_by("-generation").first()
+
+    def diff(self, previous: "LeaderboardSnapshot | None") -> dict:
+        """
+        What changed since the `previous` snapshot: for every ranking, the players whose rank
+        changed (with a null previous rank for newcomers) and the IDs of the players who left
+        it, and the kills of forsen in the games played since
+        """
+        old_rankings = previous.data["rankings"] if previous else {}
+        rankings = {}
+        for ranking, rows in self.data["rankings"].items():
+            old_ranks = {
+                row["id"]: rank for rank, row in enumerate(old_rankings.get(ranking, []), 1)
+            }
+            changed = [
+                {
+                    "id": row["id"],
+                    "name": row["name"],
+                    "rank": rank,
+                    "previous_rank": old_ranks.get(row["id"]),
+                }
+                for rank, row in enumerate(rows, 1)
+                if old_ranks.get(row["id"]) != rank
+            ]
+            left = sorted(old_ranks.keys() - {row["id"] for row in rows})
+            if changed or left:
+                rankings[ranking] = {"changed": changed, "left": left}
+
+        new_kills = []
+        if previous is not None and previous.data["last_game_date"] is not None:
+            kills = PlayerMatchStats.objects.filter(
+                killscore__gt=0,
+                match__created_at__gt=datetime.datetime.fromisoformat(
+                    previous.data["last_game_date"]
+                ),
+            ).order_by("match__created_at", "match_id", "player_id")
+            new_kills = [
+                {
+                    "id": player_id,
+                    "name": name,
+                    "weapon": weapon,
+                    "killscore": killscore,
+                    "date": created_at.isoformat(),
+                }
+                for player_id, name, weapon, killscore, created_at in kills.values_list(
+                    "player_id",
+                    "player__name",
+                    "killed_forsen_with",
+                    "killscore",
+                    "match__created_at",
+                )[: self.DIFF_KILLS]
+            ]
+        return {
+            "generation": self.generation,
+            "previous_generation": previous.generation if previous else None,
+            "nb_games": self.data["nb_games"],
+            "rankings": rankings,
+            "new_kills": new_kills,
+        }
+
+    @classmethod
+    def compute(cls) -> dict:
+        rankings = {}
+        for ranking, (order_by, only_regulars) in cls.RANKINGS.items():
+            players = Player.objects.regulars() if only_regulars else Player.objects.all()
+            players = players.order_by(*order_by)[: cls.ROWS_PER_RANKING]
+            if ranking == "killscore":
+                # Kills by weapon are counted for the top players only, picked from the index
+                players = Player.objects.filter(id__in=players.values("id"))
+                players = players.with_kills_by_weapon(KILLSCORE_TABLE_WEAPONS).order_by(*order_by)
+                extra_fields = KILLSCORE_TABLE_WEAPONS.keys()
+            else:
+                extra_fields = ("kd", "dpg", "kpg")
+            rankings[ranking] = list(players.values(*cls.PLAYER_FIELDS, *extra_fields))
+
+        dates = Match.objects.filter(created_at__isnull=False).order_by("created_at")
+        first_game, last_game = dates.first(), dates.last()
+        return {
+            "rankings": rankings,
+            "nb_games": Match.objects.count(),
+            "first_game_date": first_game.created_at.isoformat() if first_game else None,
+            "last_game_date": last_game.created_at.isoformat() if last_game else None,
+        }
+
+
+def killscore_expression():
+    """
+    SQL version of PlayerMatchStats.compute_killscore, computing the killscores of many rows
+    in a single statement
+    """
+    base_kill_value = Value(44682.0) + Value(-9389.0) * Ln("forsen_final_rank")
+    multiplier = Case(
+        *[
+            When(killed_forsen_with=weapon, then=Value(float(multiplier)))
+            for weapon, multiplier in WEAPON_KILLSCORE_MULTIPLIERS.items()
+        ],
+        default=Value(1.0),
+    )
+    return Case(
+        # Gunfrogs out!
+        When(killed_forsen_with="Damage_Gun", forsen_final_rank__gt=5, then=Value(0)),
+        default=Cast(multiplier * base_kill_value, models.IntegerField()),
+    )
+
+
+class PlayerMatchStatsQuerySet(models.QuerySet):
+    def compute_killscores(self) -> int:
+        """
+        Recompute the killscore of every forsen kill of the queryset with a single UPDATE
+        Returns the number of updated rows
+        """
+        kills = self.filter(killed_forsen_with__isnull=False, forsen_final_rank__isnull=False)
+        unhandled_weapons = (
+            kills.exclude(killed_forsen_with__in=WEAPON_KILLSCORE_MULTIPLIERS)
+            .values_list("killed_forsen_with", flat=True)
+            .distinct()
+        )
+        for weapon in unhandled_weapons:
+            logger.warning(f"Unhandled killscore multiplier for {weapon}")
+        return kills.update(killscore=killscore_expression())
 
 
 class PlayerMatchStats(models.Model):
@@ -34,6 +269,8 @@ class PlayerMatchStats(models.Model):
     forsen_final_rank = models.IntegerField(null=True)
     killscore = models.IntegerField(default=0)
 
+    objects = PlayerMatchStatsQuerySet.as_manager()
+
     class Meta:
         unique_together = ("player", "match")
 
@@ -66,7 +303,6 @@ class Match(models.Model):
     forsen_final_rank = models.IntegerField(null=True)
     nb_forsen_kills = models.IntegerField(null=True)
     nb_forsen_bot_kills = models.IntegerField(null=True)
-    telemetry_data_gz = models.BinaryField("Telemetry Data", null=True)
 
     def __str__(self):
         return self.id
@@ -76,23 +312,55 @@ class Match(models.Model):
         Get info from the PUBG API for a match
         Can fail and raise pubg.api.APIError
         """
+        match_info, telemetry_data = self.fetch_from_api(with_telemetry=not self.has_telemetry())
+        with transaction.atomic():
+            self.update_from_api_data(match_info, telemetry_data)
+
+    def fetch_from_api(self, with_telemetry: bool = True) -> tuple[dict, bytes | None]:
+        """
+        Download the match info and, if with_telemetry is set, the telemetry for a match
+        Only does network requests, so it is safe to call from a worker thread
+        Can fail and raise pubg.api.APIError
+        """
         match_info = pubg.api.get_match_info(self.id)
+        if not with_telemetry:
+            return match_info, None
+
+        telemetry_url = self.get_telemetry_url(match_info)
+        if not telemetry_url:
+            return match_info, None
+
+        try:
+            return match_info, pubg.api.get_telemetry_data(telemetry_url)
+        except:
+            logger.warning(f"Could not get telemetry for match {self.id}")
+            return match_info, None
+
+    @staticmethod
+    def get_telemetry_url(match_info: dict) -> str:
+        telemetry_url = ""
+        for entry in match_info["included"]:
+            if entry["type"] == "asset" and entry["attributes"]["name"] == "telemetry":
+                telemetry_url = entry["attributes"]["URL"]
+        return telemetry_url
 
+    def update_from_api_data(self, match_info: dict, telemetry_data: bytes | None = None):
+        """
+        Update a match and its players from already downloaded API data
+        Should be called inside a transaction so that a match is never partially written
+        """
         data = match_info["data"]["attributes"]
         self.created_at = isoparse(data["createdAt"])
         self.map_name = data["mapName"]
 
         self.nb_bots = 0
         self.nb_real_players = 0
+        participants = {}
         included = match_info["included"]
-        telemetry_url = ""
         for entry in included:
             match entry["type"]:
-                case "roster":
+                case "roster" | "asset":
                     continue
-                case "asset":
-                    if entry["attributes"]["name"] == "telemetry":
-                        telemetry_url = entry["attributes"]["URL"]
                 case "participant":
                     player_stats = entry["attributes"]["stats"]
 
@@ -104,111 +372,137 @@ class Match(models.Model):
                     else:
                         self.nb_real_players += 1
 
-                    player, created = Player.objects.get_or_create(id=player_stats["playerId"])
-                    if created:
-                        player.name = player_stats["name"]
-                        player.save()
-
-                    if player.id == FORSEN_PLAYERID:
+                    if player_stats["playerId"] == FORSEN_PLAYERID:
                         self.is_forsen_match = True
 
-                    player_match_stats, _ = PlayerMatchStats.objects.get_or_create(
-                        player=player, match=self
-                    )
-                    player_match_stats.damage_dealt = player_stats["damageDealt"]
-                    player_match_stats.ride_distance = player_stats["rideDistance"]
-                    player_match_stats.walk_distance = player_stats["walkDistance"]
-                    player_match_stats.time_survived = player_stats["timeSurvived"]
-                    player_match_stats.save()
+                    participants[player_stats["playerId"]] = player_stats
                 case _:
                     logger.warning(f"Type {entry['type']} is not handled")
-        if telemetry_url and not self.telemetry_data_gz:
+
+        # Existing players keep their name, new ones are created with the name from this match
+        existing_player_ids = set(
+            Player.objects.filter(id__in=participants).values_list("id", flat=True)
+        )
+        new_players = [
+            Player(id=id, name=stats["name"], name_updated_at=self.created_at)
+            for id, stats in participants.items()
+            if id not in existing_player_ids
+        ]
+        Player.objects.bulk_create(new_players, ignore_conflicts=True)
+        PlayerNameTrigram.index(new_players, replace=False)
+
+        existing_stats = {
+            pms.player_id: pms
+            for pms in PlayerMatchStats.objects.filter(match=self, player__in=participants)
+        }
+        new_stats = []
+        for player_id, player_stats in participants.items():
+            player_match_stats = existing_stats.get(player_id)
+            if player_match_stats is None:
+                player_match_stats = PlayerMatchStats(player_id=player_id, match=self)
+                new_stats.append(player_match_stats)
+            player_match_stats.damage_dealt = player_stats["damageDealt"]
+            player_match_stats.ride_distance = player_stats["rideDistance"]
+            player_match_stats.walk_distance = player_stats["walkDistance"]
+            player_match_stats.time_survived = player_stats["timeSurvived"]
+        PlayerMatchStats.objects.bulk_create(new_stats, ignore_conflicts=True)
+        PlayerMatchStats.objects.bulk_update(
+            existing_stats.values(),
+            ["damage_dealt", "ride_distance", "walk_distance", "time_survived"],
+        )
+
+        if telemetry_data is not None:
+            MatchTelemetry.objects.update_or_create(
+                match=self, defaults={"data": pubg.compression.compress(telemetry_data)}
+            )
             try:
-                telemetry_data = pubg.api.get_telemetry_data(telemetry_url)
-                self.telemetry_data_gz = gzip.compress(telemetry_data)
-                self.update_from_telemetry(telemetry_data=telemetry_data)
+                with transaction.atomic():
+                    self.update_from_telemetry(telemetry_data=telemetry_data)
             except:
-                logger.warning(f"Could not get telemetry for match {self.id}")
-        elif self.telemetry_data_gz:
+                logger.warning(f"Could not process telemetry for match {self.id}")
+        else:
             self.update_from_telemetry()
         self.save()
 
-    def update_stats_LogPlayerKillV2(self, telemetry_obj: dict):
-        damage_type_category = telemetry_obj["killerDamageInfo"]["damageTypeCategory"]
-        if damage_type_category == "Damage_Explosion_StickyBomb":
-            damage_type_category = "Damage_Explosion_C4"
-        self.forsen_died_to_cause = damage_type_category
-        self.save()
-
-        victim_accountid = telemetry_obj["victim"]["accountId"]
-        if victim_accountid.startswith("npc."):
-            return
-        if victim_accountid.startswith("ai."):
-            self.nb_forsen_bot_kills += 1
-            self.nb_forsen_kills += 1
-            self.save()
-            return
-
-        victim = Player.objects.get(id=victim_accountid)
-        victim_stats = PlayerMatchStats.objects.get(match=self, player=victim)
-
-        if telemetry_obj["isSuicide"]:
-            # Forsen killed himself LUL
-            victim_stats.killed_by_forsen_with = damage_type_category
-            victim_stats.killed_forsen_with = damage_type_category
-            victim_stats.save()
-            return
+    def has_telemetry(self) -> bool:
+        return MatchTelemetry.objects.filter(match=self).exists()
 
-        if victim.id == FORSEN_PLAYERID:
-            self.forsen_final_rank = telemetry_obj["victimGameResult"]["rank"]
-            if telemetry_obj["killer"]:
-                killer_accountid = telemetry_obj["killer"].get("accountId")
-            else:
-                # Died to e.g vehicle without driver
-                return
-            self.forsen_died_to_account = killer_accountid
-            self.save()
-            if killer_accountid.startswith("npc.") or killer_accountid.startswith("ai."):
-                return
-            killer = Player.objects.get(id=killer_accountid)
-            killer_stats = PlayerMatchStats.objects.get(match=self, player=killer)
-            killer_stats.killed_forsen_with = damage_type_category
-            killer_stats.forsen_final_rank = telemetry_obj["victimGameResult"]["rank"]
-            killer_stats.killscore = killer_stats.compute_killscore()
-            killer_stats.save()
-        else:  # killer is forsen
-            self.nb_forsen_kills += 1
-            self.save()
-            victim_stats.killed_by_forsen_with = damage_type_category
-            victim_stats.save()
-
-    def update_stats_LogPlayerTakeDamage(self, telemetry_obj: dict):
-        if telemetry_obj["attacker"] is None:
-            # Forsen damaged himself LUL
-            return
-
-        attacker_accountid = telemetry_obj["attacker"]["accountId"]
-        if attacker_accountid.startswith("ai.") or attacker_accountid.startswith("npc."):
-            return
-
-        attacker = Player.objects.get(id=attacker_accountid)
-        attacker_stats = PlayerMatchStats.objects.get(match=self, player=attacker)
-        attacker_stats.damage_to_forsen += telemetry_obj["damage"]
-        attacker_stats.save()
-
-    def update_stats_LogVehicleRide(self, telemetry_obj: dict):
-        pass
+    def open_telemetry(self):
+        """
+        Load the stored telemetry of this match and return it as a decompressed file object,
+        or None if there is no stored telemetry
+        """
+        data = MatchTelemetry.load(self.id)
+        if data is None:
+            return None
+        return pubg.compression.open_blob(data)
 
     def reset_all_incrementable_stats(self):
         """
-        Reset every player's incrementable stats for this match
+        Reset every player's stats from the telemetry for this match, so that players the
+        telemetry no longer credits don't keep their old kills and killscores
         """
         if self.is_forsen_match:
             self.nb_forsen_kills = 0
             self.nb_forsen_bot_kills = 0
-        for player_match_stats in PlayerMatchStats.objects.filter(match=self):
-            player_match_stats.damage_to_forsen = 0
-            player_match_stats.save()
+        PlayerMatchStats.objects.filter(match=self).update(
+            damage_to_forsen=0,
+            killed_forsen_with=None,
+            killed_by_forsen_with=None,
+            forsen_final_rank=None,
+            killscore=0,
+        )
+
+    def apply_telemetry_stats(self, stats: pubg.telemetry.TelemetryStats, save_events=True):
+        """
+        Write the stats extracted from the telemetry of this match, and the forsen events they
+        were computed from unless save_events is False, with a constant number of queries
+        """
+        if save_events:
+            ForsenEvent.objects.filter(match=self).delete()
+            ForsenEvent.objects.bulk_create(
+                [
+                    ForsenEvent.from_event(self, index, event)
+                    for index, event in enumerate(stats.events)
+                ]
+            )
+
+        self.reset_all_incrementable_stats()
+        if self.is_forsen_match:
+            self.nb_forsen_kills = stats.nb_forsen_kills
+            self.nb_forsen_bot_kills = stats.nb_forsen_bot_kills
+        for field in ("forsen_died_to_cause", "forsen_died_to_account", "forsen_final_rank"):
+            if (value := getattr(stats, field)) is not None:
+                setattr(self, field, value)
+
+        players = (
+            stats.damage_to_forsen.keys()
+            | stats.killed_forsen_with.keys()
+            | stats.killed_by_forsen_with.keys()
+        )
+        players_match_stats = list(PlayerMatchStats.objects.filter(match=self, player__in=players))
+        for player_match_stats in players_match_stats:
+            player_id = player_match_stats.player_id
+            player_match_stats.match = self
+            if player_id in stats.damage_to_forsen:
+                player_match_stats.damage_to_forsen = stats.damage_to_forsen[player_id]
+            if player_id in stats.killed_forsen_with:
+                player_match_stats.killed_forsen_with = stats.killed_forsen_with[player_id]
+            if player_id in stats.killed_by_forsen_with:
+                player_match_stats.killed_by_forsen_with = stats.killed_by_forsen_with[player_id]
+            if player_id == stats.forsen_killer:
+                player_match_stats.forsen_final_rank = stats.forsen_final_rank
+                player_match_stats.killscore = player_match_stats.compute_killscore()
+        PlayerMatchStats.objects.bulk_update(
+            players_match_stats,
+            [
+                "damage_to_forsen",
+                "killed_forsen_with",
+                "killed_by_forsen_with",
+                "forsen_final_rank",
+                "killscore",
+            ],
+        )
         self.save()
 
     def update_from_telemetry(self, telemetry_data=None) -> bool:
@@ -216,44 +510,371 @@ class Match(models.Model):
         Get the telemetry info for a match and update stats
         Can fail and raise pubg.api.APIError
         """
+        if telemetry_data is not None:
+            telemetry_file = io.BytesIO(telemetry_data)
+        elif (telemetry_file := self.open_telemetry()) is None:
+            return False
 
-        def attacker_is_forsen(telemetry_obj: dict) -> bool:
-            attacker = telemetry_obj.get("attacker") or telemetry_obj.get("killer")
-            return attacker is not None and attacker["accountId"] == FORSEN_PLAYERID
+        self.apply_telemetry_stats(pubg.telemetry.extract_stats(telemetry_file))
+        return True
 
-        def victim_is_forsen(telemetry_obj: dict) -> bool:
-            return telemetry_obj["victim"]["accountId"] == FORSEN_PLAYERID
+    def forsen_events_stats(self) -> pubg.telemetry.TelemetryStats:
+        """
+        Recompute the telemetry stats of this match from its stored forsen events,
+        without touching the telemetry
+        """
+        events = self.forsen_events.order_by("index")
+        return pubg.telemetry.TelemetryStats.from_events(event.to_event() for event in events)
 
-        def is_forsen_related(telemetry_obj: dict) -> bool:
-            if (fellow_passengers := telemetry_obj.get("fellowPassengers")) is not None:
-                # LogVehicleRide
-                return telemetry_obj["character"]["accountId"] == FORSEN_PLAYERID or any(
-                    [passenger["accountId"] == FORSEN_PLAYERID for passenger in fellow_passengers]
+
+class MatchTelemetry(models.Model):
+    """
+    Compressed telemetry of a match, in any format pubg.compression can read
+    Kept out of the Match table so that match queries never load multi-MB blobs
+    """
+
+    match = models.OneToOneField(
+        Match, on_delete=models.CASCADE, primary_key=True, related_name="telemetry"
+    )
+    data = models.BinaryField("Telemetry Data")
+
+    def __str__(self):
+        return str(self.match_id)
+
+    @classmethod
+    def load(cls, match_id: str) -> bytes | None:
+        """Compressed telemetry of a match, or None if it is not stored"""
+        data = cls.objects.filter(match_id=match_id).values_list("data", flat=True).first()
+        return None if data is None else bytes(data)
+
+
+class ForsenEvent(models.Model):
+    """
+    Compact copy of a telemetry event involving forsen: a kill, damage to forsen or a vehicle
+    ride. Written at ingestion so that stats can be recomputed without the telemetry
+    """
+
+    match = models.ForeignKey(Match, on_delete=models.CASCADE, related_name="forsen_events")
+    index = models.IntegerField()  # Position among the forsen events of the match
+    type = models.CharField(max_length=32)  # LogPlayerKillV2, LogPlayerTakeDamage, ...
+    timestamp = models.DateTimeField(null=True)
+    account_id = models.CharField(max_length=64, null=True)  # Attacker, killer or character
+    victim_account_id = models.CharField(max_length=64, null=True)
+    damage = models.FloatField(null=True)
+    damage_type_category = models.CharField(max_length=64, null=True)
+    rank = models.IntegerField(null=True)  # Rank of the victim
+    is_suicide = models.BooleanField(default=False)
+
+    class Meta:
+        unique_together = ("match", "index")
+        indexes = [
+            models.Index(fields=["type", "account_id"]),
+            models.Index(fields=["type", "victim_account_id"]),
+        ]
+
+    @classmethod
+    def from_event(cls, match: Match, index: int, event: pubg.telemetry.Event) -> "ForsenEvent":
+        fields = event._asdict()
+        if fields["timestamp"]:
+            fields["timestamp"] = isoparse(fields["timestamp"])
+        return cls(match=match, index=index, **fields)
+
+    def to_event(self) -> pubg.telemetry.Event:
+        return pubg.telemetry.Event(
+            **{field: getattr(self, field) for field in pubg.telemetry.Event._fields}
+        )
+
+
+class TelemetryDictionary(models.Model):
+    """
+    zstd dictionary trained on our telemetry archive, referenced by ID from compressed blobs
+    """
+
+    id = models.PositiveIntegerField(primary_key=True)  # zstd dictionary ID
+    data = models.BinaryField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+
+def player_stats_aggregates(prefix: str = "") -> dict:
+    """
+    Aggregates computing the stats of a player from his PlayerMatchStats rows
+    `prefix` is the lookup path from the queried model to PlayerMatchStats
+    """
+    killed_forsen = Q(**{f"{prefix}killscore__gt": 0})
+    return {
+        "killscore": Coalesce(Sum(f"{prefix}killscore", filter=killed_forsen), 0),
+        "kills": Count(f"{prefix}id", filter=killed_forsen),
+        "deaths": Count(
+            f"{prefix}id", filter=Q(**{f"{prefix}killed_by_forsen_with__isnull": False})
+        ),
+        "games_sniped": Count(f"{prefix}id", filter=Q(**{f"{prefix}match__is_forsen_match": True})),
+    }
+
+
+def name_trigrams(name: str) -> set[str]:
+    """Lowercase 3-character substrings of a name, what the player search index is made of"""
+    name = name.lower()
+    return {name[i : i + 3] for i in range(len(name) - 2)}
+
+
+class PlayerQuerySet(models.QuerySet):
+    def search(self, query: str):
+        """
+        Players whose name contains `query`, case-insensitively
+        Candidates are the players whose name has every trigram of the query, which uses the
+        PlayerNameTrigram index instead of scanning all names, so players missing from the index
+        are never found. Queries shorter than a trigram can't use it.
+        """
+        if not (trigrams := name_trigrams(query)):
+            return self.filter(name__icontains=query)
+        candidates = (
+            PlayerNameTrigram.objects.filter(trigram__in=trigrams)
+            .values("player")
+            .annotate(nb_trigrams=Count("*"))
+            .filter(nb_trigrams=len(trigrams))
+            .values("player")
+        )
+        return self.filter(id__in=candidates, name__icontains=query)
+
+    def compute_stats(self) -> int:
+        """
+        Recompute the stats of every player of the queryset with a single grouped query
+        Only players whose stats changed are written back, returns how many there were
+        """
+        aggregates = player_stats_aggregates("playermatchstats__")
+        players = self.filter(is_forsen=False).annotate(
+            **{f"new_{field}": aggregate for field, aggregate in aggregates.items()}
+        )
+        changed = []
+        for player in players:
+            if any(
+                getattr(player, f"new_{field}") != getattr(player, field) for field in aggregates
+            ):
+                for field in aggregates:
+                    setattr(player, field, getattr(player, f"new_{field}"))
+                player.update_ratios()
+                changed.append(player)
+        self.model.objects.bulk_update(
+            changed, [*aggregates.keys(), *self.model.RATIO_FIELDS], batch_size=500
+        )
+        return len(changed)
+
+    def add_match_stats(self, match_ids) -> int:
+        """
+        Incrementally add the stats from newly ingested matches to the players of the queryset
+        Only correct for matches that were not counted in the players' stats yet
+        Returns the number of updated players
+        """
+        aggregates = player_stats_aggregates()
+        deltas = (
+            PlayerMatchStats.objects.filter(
+                match__in=match_ids, player__in=self.filter(is_forsen=False)
+            )
+            .values("player")
+            .annotate(**{f"delta_{field}": aggregate for field, aggregate in aggregates.items()})
+        )
+        deltas = {delta.pop("player"): delta for delta in deltas}
+        players = list(self.filter(id__in=deltas))
+        for player in players:
+            for field in aggregates:
+                setattr(player, field, getattr(player, field) + deltas[player.id][f"delta_{field}"])
+            player.update_ratios()
+        self.model.objects.bulk_update(
+            players, [*aggregates.keys(), *self.model.RATIO_FIELDS], batch_size=500
+        )
+        return len(players)
+
+    def with_kills_by_weapon(self, columns: dict[str, tuple[str, ...]]):
+        """
+        Annotate the players with how many times they killed forsen with each group of weapons,
+        e.g. {"punch": ("Damage_Punch", "Damage_Melee")}, in the same query as the players
+        """
+        return self.annotate(
+            **{
+                column: Count(
+                    "playermatchstats",
+                    filter=Q(playermatchstats__killed_forsen_with__in=weapons),
                 )
-            return attacker_is_forsen(telemetry_obj) or victim_is_forsen(telemetry_obj)
+                for column, weapons in columns.items()
+            }
+        )
 
-        if telemetry_data is None:
-            if self.telemetry_data_gz:
-                telemetry_data = gzip.decompress(self.telemetry_data_gz)
-            else:
-                return False
+    def regulars(self):
+        """Players with more than 10 kills + deaths, the only ones in most rankings"""
+        return self.filter(eligible=True)
 
-        self.reset_all_incrementable_stats()
+    def with_stale_names(self, max_age: datetime.timedelta):
+        """Players whose name was not checked for `max_age`, least recently checked first"""
+        stale = Q(name_updated_at__isnull=True) | Q(name_updated_at__lt=timezone.now() - max_age)
+        return self.filter(stale).order_by(F("name_updated_at").asc(nulls_first=True))
 
-        telemetry_json = json.loads(telemetry_data)
-        for telemetry_obj in telemetry_json:
-            match telemetry_obj["_T"]:
-                case "LogPlayerKillV2" if is_forsen_related(telemetry_obj):
-                    self.update_stats_LogPlayerKillV2(telemetry_obj)
-                    if victim_is_forsen(telemetry_obj):
-                        # We don't care about stats after forsen dies
-                        return True
-                case "LogPlayerTakeDamage" if victim_is_forsen(telemetry_obj):
-                    self.update_stats_LogPlayerTakeDamage(telemetry_obj)
-                case "LogVehicleRide" if is_forsen_related(telemetry_obj):
-                    self.update_stats_LogVehicleRide(telemetry_obj)
+    def update_names_from_api(self) -> int:
+        """
+        Get the current names of the players of the queryset from the PUBG API, asking for
+        PLAYERS_PER_REQUEST players per request. Returns the number of renamed players
+        Can fail and raise pubg.api.APIError
+        """
+        players = list(self)
+        now = timezone.now()
+        renamed = []
+        for i in range(0, len(players), pubg.api.PLAYERS_PER_REQUEST):
+            batch = {player.id: player for player in players[i : i + pubg.api.PLAYERS_PER_REQUEST]}
+            for player_info in pubg.api.get_players_info(list(batch)):
+                player = batch[player_info["id"]]
+                name = player_info["attributes"]["name"]
+                if name != player.name:
+                    logger.info(f"{player.name} is now called {name}")
+                    player.name = name
+                    renamed.append(player)
+            # Players missing from the response (e.g. deleted accounts) are not asked for again
+            # until their name is stale again
+            for player in batch.values():
+                player.name_updated_at = now
+            self.model.objects.bulk_update(batch.values(), ["name", "name_updated_at"])
+        PlayerNameTrigram.index(renamed)
+        return len(renamed)
+
+
+class LeaseLost(Exception):
+    pass
+
+
+class IngestJob(models.Model):
+    """
+    Ingestion of one match, leased by workers so that several of them can run at once
+    A job first gets the match info and telemetry, then only retries the telemetry download
+    if it failed. Failed attempts are retried later with exponential backoff.
+    """
 
-        return True
+    PENDING = "pending"
+    DONE = "done"
+    FAILED = "failed"
+
+    STAGE_MATCH = "match"
+    STAGE_TELEMETRY = "telemetry"
+
+    MAX_ATTEMPTS = 10
+    RETRY_DELAY = datetime.timedelta(minutes=1)
+    MAX_RETRY_DELAY = datetime.timedelta(hours=6)
+
+    match = models.OneToOneField(
+        Match, on_delete=models.CASCADE, primary_key=True, related_name="ingest_job"
+    )
+    state = models.CharField(max_length=16, default=PENDING)
+    stage = models.CharField(max_length=16, default=STAGE_MATCH)
+    attempts = models.IntegerField(default=0)
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    leased_by = models.CharField(max_length=64, null=True)
+    lease_expires_at = models.DateTimeField(null=True)
+    telemetry_url = models.CharField(max_length=512, null=True)
+    last_error = models.TextField(null=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [models.Index(fields=["state", "next_attempt_at"])]
+
+    def __str__(self):
+        return f"{self.match_id} ({self.state}, {self.stage})"
+
+    @classmethod
+    def enqueue_new_matches(cls) -> int:
+        """Create a job for every match that was never ingested and has no job yet"""
+        new_matches = Match.objects.filter(created_at__isnull=True, ingest_job__isnull=True)
+        jobs = [cls(match_id=match_id) for match_id in new_matches.values_list("id", flat=True)]
+        cls.objects.bulk_create(jobs, ignore_conflicts=True)
+        return len(jobs)
+
+    @classmethod
+    def lease(cls, worker: str, count: int, duration: datetime.timedelta) -> list["IngestJob"]:
+        """
+        Lease up to `count` jobs that are due, including jobs whose lease expired because
+        their worker crashed. The conditional UPDATE makes sure a job has only one owner.
+        """
+        now = timezone.now()
+        available = cls.objects.filter(state=cls.PENDING, next_attempt_at__lte=now).filter(
+            Q(lease_expires_at__isnull=True) | Q(lease_expires_at__lt=now)
+        )
+        candidates = list(
+            available.order_by("next_attempt_at").values_list("pk", flat=True)[:count]
+        )
+        lease_expires_at = now + duration
+        available.filter(pk__in=candidates).update(
+            leased_by=worker, lease_expires_at=lease_expires_at
+        )
+        return list(
+            cls.objects.filter(
+                pk__in=candidates, leased_by=worker, lease_expires_at=lease_expires_at
+            ).select_related("match")
+        )
+
+    def fetch(self, with_telemetry: bool) -> tuple[dict | None, bytes | None]:
+        """
+        Download what this job still needs, only does network requests
+        Can fail and raise pubg.api.APIError
+        """
+        if self.stage == self.STAGE_TELEMETRY:
+            return None, pubg.api.get_telemetry_data(self.telemetry_url)
+        return self.match.fetch_from_api(with_telemetry=with_telemetry)
+
+    def apply(self, match_info: dict | None, telemetry_data: bytes | None, with_telemetry: bool):
+        """
+        Write the downloaded data and the updated player stats in one transaction
+        Raises LeaseLost, without writing anything, if another worker took over the job
+        """
+        match = self.match
+        with transaction.atomic():
+            if self.stage == self.STAGE_MATCH:
+                match.update_from_api_data(match_info, telemetry_data)
+                # The match was not counted in any player's stats yet, only add its stats
+                Player.objects.add_match_stats([match.id])
+                telemetry_url = match.get_telemetry_url(match_info)
+                if with_telemetry and telemetry_url and telemetry_data is None:
+                    self.telemetry_url = telemetry_url
+                    self._finish_attempt(
+                        "Could not get telemetry", stage=self.STAGE_TELEMETRY, retry=True
+                    )
+                    return
+            else:
+                MatchTelemetry.objects.update_or_create(
+                    match=match, defaults={"data": pubg.compression.compress(telemetry_data)}
+                )
+                match.update_from_telemetry(telemetry_data=telemetry_data)
+                match.save()
+                players = PlayerMatchStats.objects.filter(match=match).values("player")
+                Player.objects.filter(id__in=players).compute_stats()
+            self._finish_attempt(state=self.DONE)
+
+    def fail(self, error: str):
+        with transaction.atomic():
+            self._finish_attempt(error, retry=True)
+
+    def _finish_attempt(self, error: str | None = None, retry=False, **fields):
+        """Record the outcome of an attempt and release the lease"""
+        self.attempts += 1
+        self.last_error = error
+        if retry:
+            if self.attempts >= self.MAX_ATTEMPTS:
+                self.state = self.FAILED
+            delay = min(self.RETRY_DELAY * 2 ** (self.attempts - 1), self.MAX_RETRY_DELAY)
+            self.next_attempt_at = timezone.now() + delay
+        for field, value in fields.items():
+            setattr(self, field, value)
+        updated = IngestJob.objects.filter(
+            pk=self.pk, leased_by=self.leased_by, lease_expires_at=self.lease_expires_at
+        ).update(
+            state=self.state,
+            stage=self.stage,
+            attempts=self.attempts,
+            next_attempt_at=self.next_attempt_at,
+            telemetry_url=self.telemetry_url,
+            last_error=self.last_error,
+            leased_by=None,
+            lease_expires_at=None,
+            updated_at=timezone.now(),
+        )
+        if not updated:
+            raise LeaseLost(f"Lost the lease of the ingestion job of match {self.match_id}")
 
 
 class Player(models.Model):
@@ -265,13 +886,57 @@ class Player(models.Model):
     deaths = models.IntegerField(default=0)
     games_sniped = models.IntegerField(default=0)
     killscore = models.IntegerField(default=0)
+    # When the name was last known to be current, null for players created before it existed
+    name_updated_at = models.DateTimeField(null=True)
+    # Derived from the stats by update_ratios() and stored so that the rankings can be read
+    # from indexes: K/D, deaths per game, kills per game, and whether the player has more
+    # than 10 kills + deaths, which most rankings require
+    kd = models.FloatField(default=0)
+    dpg = models.FloatField(default=0)
+    kpg = models.FloatField(default=0)
+    eligible = models.BooleanField(default=False)
+
+    RATIO_FIELDS = ("kd", "dpg", "kpg", "eligible")
+
+    objects = PlayerQuerySet.as_manager()
 
     class Meta:
-        indexes = [models.Index(fields=["name"])]
+        indexes = [
+            models.Index(fields=["name"]),
+            models.Index(fields=["name_updated_at"]),
+            # One per ordering of LeaderboardSnapshot.RANKINGS. Rankings of eligible players
+            # use partial indexes: SQLite can't use an index on the flag for "WHERE eligible"
+            models.Index(fields=["killscore", "id"], name="player_killscore_idx"),
+            models.Index(fields=["kills", "id"], name="player_kills_idx"),
+            models.Index(
+                fields=["-kd", "-deaths", "-id"],
+                name="player_best_kd_idx",
+                condition=Q(eligible=True),
+            ),
+            models.Index(
+                fields=["kd", "-deaths", "-id"],
+                name="player_worst_kd_idx",
+                condition=Q(eligible=True),
+            ),
+            models.Index(fields=["dpg", "id"], name="player_dpg_idx", condition=Q(eligible=True)),
+            models.Index(fields=["kpg", "id"], name="player_kpg_idx", condition=Q(eligible=True)),
+            models.Index(
+                fields=["deaths", "id"], name="player_deaths_idx", condition=Q(eligible=True)
+            ),
+            models.Index(
+                fields=["games_sniped", "id"], name="player_games_idx", condition=Q(eligible=True)
+            ),
+        ]
 
     def __str__(self):
         return self.name
 
+    def save(self, *args, **kwargs):
+        super().save(*args, **kwargs)
+        # Keep the search index in sync with the name, bulk_create and bulk_update can't
+        if (update_fields := kwargs.get("update_fields")) is None or "name" in update_fields:
+            PlayerNameTrigram.index([self])
+
     def update_from_api(self):
         """
         Get info from the PUBG API for a player (name + all matches):
@@ -279,6 +944,7 @@ class Player(models.Model):
         """
         player_info = pubg.api.get_player_info(self.id)["data"]
         self.name = player_info["attributes"]["name"]
+        self.name_updated_at = timezone.now()
         self.save()
 
         for match_data in player_info["relationships"]["matches"]["data"]:
@@ -286,16 +952,58 @@ class Player(models.Model):
                 match, _ = Match.objects.get_or_create(id=match_data["id"])
                 PlayerMatchStats.objects.get_or_create(player=self, match=match)
 
+    def kills_by_weapon(self) -> dict[str, int]:
+        """How many times the player killed forsen with each weapon, by damage type"""
+        return dict(
+            PlayerMatchStats.objects.filter(player=self, killed_forsen_with__in=WEAPON_NAMES)
+            .values_list("killed_forsen_with")
+            .annotate(Count("id"))
+            .order_by()
+        )
+
+    def update_ratios(self):
+        """Update the ratio fields from the stats, which must be saved along with them"""
+        self.kd = self.kills / self.deaths if self.deaths else 0.0
+        self.dpg = self.deaths / self.games_sniped if self.games_sniped else 0.0
+        self.kpg = self.kills / self.games_sniped if self.games_sniped else 0.0
+        self.eligible = self.kills + self.deaths > 10
+
     def compute_stats(self):
         if self.is_forsen:
             return
-        pms_with_forsen_kills = PlayerMatchStats.objects.filter(player=self, killscore__gt=0)
-        self.killscore = sum(pms_with_forsen_kills.values_list("killscore", flat=True))
-        self.kills = len(pms_with_forsen_kills)
-        self.deaths = PlayerMatchStats.objects.filter(
-            player=self, killed_by_forsen_with__isnull=False
-        ).count()
-        self.games_sniped = PlayerMatchStats.objects.filter(
-            player=self, match__is_forsen_match=True
-        ).count()
-        self.save()
+        Player.objects.filter(pk=self.pk).compute_stats()
+        self.refresh_from_db(fields=[*player_stats_aggregates().keys(), *self.RATIO_FIELDS])
+
+
+class PlayerNameTrigram(models.Model):
+    """
+    Search index of the player names: one row per trigram of the name of a player
+    Player.save() keeps it up to date, players created or renamed in bulk must be indexed
+    with index()
+    """
+
+    player = models.ForeignKey(Player, on_delete=models.CASCADE, related_name="name_trigrams")
+    trigram = models.CharField(max_length=3)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["trigram", "player"], name="unique_name_trigram")
+        ]
+
+    def __str__(self):
+        return f"{self.trigram} ({self.player_id})"
+
+    @classmethod
+    def index(cls, players: list[Player], replace: bool = True):
+        """Index the current names of the players, `replace` their previous trigrams"""
+        if replace:
+            cls.objects.filter(player__in=players).delete()
+        cls.objects.bulk_create(
+            [
+                cls(player=player, trigram=trigram)
+                for player in players
+                for trigram in name_trigrams(player.name)
+            ],
+            batch_size=1000,
+            ignore_conflicts=True,
+        )
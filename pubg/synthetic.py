@@ -0,0 +1,326 @@
+"""
+Synthetic matches, players and telemetry with distributions close to forsen's games:
+a few stream snipers show up in many matches, most players in a handful, and forsen
+mostly dies to guns. Used to fill a development database and by the benchmark command.
+"""
+import contextlib
+import datetime
+import itertools
+import json
+import random
+import tempfile
+import threading
+import uuid
+from typing import Iterator
+
+from tqdm import tqdm
+
+import pubg.api
+from pubg import FORSEN_PLAYERID
+from pubg.fakeapi import API_PREFIX, FakeAPIServer, FixtureStore
+from pubg.ingest import run_jobs
+from pubg.models import IngestJob, Match, Player, Website
+
+MAP_NAMES = [
+    "Baltic_Main",
+    "Desert_Main",
+    "Savage_Main",
+    "DihorOtok_Main",
+    "Tiger_Main",
+    "Kiki_Main",
+    "Summerland_Main",
+    "Chimera_Main",
+]
+
+# How forsen dies to players, and how he kills them
+KILLED_FORSEN_WITH = {
+    "Damage_Gun": 80,
+    "Damage_Explosion_Grenade": 4,
+    "Damage_VehicleHit": 4,
+    "Damage_Molotov": 3,
+    "Damage_Melee": 2,
+    "Damage_Explosion_Vehicle": 2,
+    "Damage_Explosion_C4": 1,
+    "Damage_Explosion_StickyBomb": 1,
+    "Damage_Punch": 1,
+    "Damage_MeleeThrow": 1,
+    "Damage_Explosion_PanzerFaustWarhead": 1,
+}
+KILLED_BY_FORSEN_WITH = {
+    "Damage_Gun": 90,
+    "Damage_Explosion_Grenade": 4,
+    "Damage_VehicleHit": 3,
+    "Damage_Melee": 2,
+    "Damage_Molotov": 1,
+}
+# Average number of forsen events in the telemetry of a match, whatever its size
+KILLS_PER_MATCH = 5
+DAMAGES_PER_MATCH = 15
+RIDES_PER_MATCH = 5
+# Events that make up most of real telemetry and are not about forsen
+FILLER_EVENT_TYPES = ["LogPlayerPosition", "LogItemPickup", "LogItemEquip", "LogHeal"]
+
+NAME_PREFIXES = ["forsen", "Sniper", "xX_", "Lidl", "Baj", "Pepega", "Okayeg", "Zulul"]
+
+
+def player_name(rnd: random.Random, index: int) -> str:
+    return f"{rnd.choice(NAME_PREFIXES)}{index}"[:16]
+
+
+def character(account_id: str, name: str) -> dict:
+    return {"name": name, "teamId": 0, "accountId": account_id}
+
+
+def event(event_type: str, timestamp: datetime.datetime, **fields) -> dict:
+    # Like in real telemetry, "_T" is the last key of every event
+    return {**fields, "_D": timestamp.strftime("%Y-%m-%dT%H:%M:%S.%fZ"), "_T": event_type}
+
+
+class SyntheticMatches:
+    """
+    Generates matches in the format of the PUBG API, with their telemetry
+    `nb_players` is the size of the pool of players that play with forsen, their popularity
+    follows a Zipf distribution
+    """
+
+    def __init__(
+        self,
+        nb_players: int,
+        seed: int = 0,
+        telemetry_events: int = 2000,
+        start: datetime.datetime = datetime.datetime(2022, 1, 1, tzinfo=datetime.timezone.utc),
+    ):
+        self.random = random.Random(seed)
+        self.telemetry_events = telemetry_events
+        self.players = [
+            (f"account.{self.random.getrandbits(128):032x}", player_name(self.random, i))
+            for i in range(nb_players)
+        ]
+        self.cum_weights = list(itertools.accumulate(1 / (i + 1) for i in range(nb_players)))
+        # Players who often play with forsen also kill him and die to him more often, so that
+        # even small databases have players with enough kills + deaths for every ranking
+        self.popularity = {
+            account_id: 1 / (i + 1) for i, (account_id, _) in enumerate(self.players)
+        }
+        self.created_at = start
+
+    def actor_weights(self, characters: list[tuple[str, str]]) -> list[float]:
+        """Cumulative weights of the characters of a match, bots weigh like the rarest players"""
+        return list(
+            itertools.accumulate(
+                self.popularity.get(account_id, 1 / len(self.players))
+                for account_id, _ in characters
+            )
+        )
+
+    def pick_players(self, count: int) -> list[tuple[str, str]]:
+        picked = {}
+        count = min(count, len(self.players))
+        while len(picked) < count:
+            for player in self.random.choices(self.players, cum_weights=self.cum_weights, k=count):
+                picked.setdefault(player[0], player)
+        return list(picked.values())[:count]
+
+    def __iter__(self) -> Iterator[tuple[str, dict, bytes]]:
+        while True:
+            yield self.generate_match()
+
+    def generate_match(self) -> tuple[str, dict, bytes]:
+        """Returns the ID, the API info and the uncompressed telemetry of a new match"""
+        rnd = self.random
+        match_id = str(uuid.UUID(int=rnd.getrandbits(128)))
+        self.created_at += datetime.timedelta(minutes=rnd.randint(20, 600))
+        players = self.pick_players(rnd.randint(15, 64))
+        bots = [(f"ai.{i}", f"Bot{i}") for i in range(rnd.randint(0, 99 - len(players)))]
+        telemetry_url = f"https://telemetry-cdn.pubg.com/bluehole-pubg/steam/{match_id}.json"
+
+        included = [
+            {
+                "type": "asset",
+                "id": str(uuid.UUID(int=rnd.getrandbits(128))),
+                "attributes": {"name": "telemetry", "URL": telemetry_url},
+            }
+        ]
+        for account_id, name in [(FORSEN_PLAYERID, "Forsen"), *players, *bots]:
+            stats = {
+                "playerId": account_id,
+                "name": name,
+                "damageDealt": rnd.expovariate(1 / 150),
+                "rideDistance": rnd.expovariate(1 / 1500) if rnd.random() < 0.6 else 0,
+                "walkDistance": rnd.expovariate(1 / 1200),
+                "timeSurvived": rnd.randint(60, 1900),
+            }
+            included.append({"type": "participant", "attributes": {"stats": stats}})
+        match_info = {
+            "data": {
+                "type": "match",
+                "id": match_id,
+                "attributes": {
+                    "createdAt": self.created_at.strftime("%Y-%m-%dT%H:%M:%SZ"),
+                    "mapName": rnd.choice(MAP_NAMES),
+                },
+            },
+            "included": included,
+        }
+        return match_id, match_info, self.generate_telemetry(players, bots)
+
+    def generate_telemetry(self, players: list, bots: list) -> bytes:
+        rnd = self.random
+        forsen = character(FORSEN_PLAYERID, "Forsen")
+        alive = players + bots
+        timestamp = self.created_at
+        rank = len(players) + len(bots) + 1
+        # Forsen dies at some point of the match, the rest of the telemetry is never read
+        forsen_death = rnd.randint(self.telemetry_events // 4, self.telemetry_events)
+        events = []
+        weights = self.actor_weights(alive)
+        # Forsen dies after 5/8 of the events on average
+        expected_events = max(self.telemetry_events * 5 / 8, 1)
+        kill_rate = KILLS_PER_MATCH / expected_events
+        damage_rate = kill_rate + DAMAGES_PER_MATCH / expected_events
+        ride_rate = damage_rate + RIDES_PER_MATCH / expected_events
+        for _ in range(forsen_death):
+            timestamp += datetime.timedelta(milliseconds=rnd.randint(0, 500))
+            if alive:
+                account_id, name = rnd.choices(alive, cum_weights=weights)[0]
+            else:
+                account_id, name = FORSEN_PLAYERID, "Forsen"
+            roll = rnd.random()
+            if roll < kill_rate and alive:
+                victim = (account_id, name)
+                alive.remove(victim)
+                weights = self.actor_weights(alive)
+                rank -= 1
+                events.append(
+                    event(
+                        "LogPlayerKillV2",
+                        timestamp,
+                        victim=character(*victim),
+                        victimGameResult={"rank": max(rank, 2)},
+                        killer=forsen,
+                        killerDamageInfo={
+                            "damageTypeCategory": rnd.choices(
+                                list(KILLED_BY_FORSEN_WITH), KILLED_BY_FORSEN_WITH.values()
+                            )[0]
+                        },
+                        isSuicide=False,
+                    )
+                )
+            elif roll < damage_rate and alive:
+                events.append(
+                    event(
+                        "LogPlayerTakeDamage",
+                        timestamp,
+                        attacker=character(account_id, name),
+                        victim=forsen,
+                        damageTypeCategory="Damage_Gun",
+                        damage=rnd.uniform(5, 60),
+                    )
+                )
+            elif roll < ride_rate:
+                events.append(
+                    event(
+                        "LogVehicleRide",
+                        timestamp,
+                        character=forsen,
+                        vehicle={"vehicleId": "Uaz_A_01_C"},
+                        fellowPassengers=[],
+                    )
+                )
+            else:
+                events.append(
+                    event(
+                        rnd.choice(FILLER_EVENT_TYPES),
+                        timestamp,
+                        character=character(account_id, name),
+                        location={"x": rnd.uniform(0, 8e5), "y": rnd.uniform(0, 8e5), "z": 0},
+                    )
+                )
+
+        # Usually killed by a player, sometimes by a bot or the blue zone
+        roll = rnd.random()
+        killer = None
+        alive_players = [player for player in alive if not player[0].startswith("ai.")]
+        alive_bots = [player for player in alive if player[0].startswith("ai.")]
+        if roll < 0.85 and alive_players:
+            killer = character(
+                *rnd.choices(alive_players, cum_weights=self.actor_weights(alive_players))[0]
+            )
+        elif roll < 0.95 and alive_bots:
+            killer = character(*rnd.choice(alive_bots))
+        events.append(
+            event(
+                "LogPlayerKillV2",
+                timestamp,
+                victim=forsen,
+                victimGameResult={"rank": max(rank - rnd.randint(0, 5), 1)},
+                killer=killer,
+                killerDamageInfo={
+                    "damageTypeCategory": rnd.choices(
+                        list(KILLED_FORSEN_WITH), KILLED_FORSEN_WITH.values()
+                    )[0]
+                    if killer
+                    else "Damage_BlueZone"
+                },
+                isSuicide=False,
+            )
+        )
+        return json.dumps(events).encode()
+
+
+@contextlib.contextmanager
+def fake_api(store: FixtureStore):
+    """Point pubg.api at a FakeAPIServer serving `store`, without the response cache"""
+    server = FakeAPIServer(("127.0.0.1", 0), store)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    host, port = server.server_address[:2]
+    saved = pubg.api.API_URL, pubg.api.TELEMETRY_URL, pubg.api.client.cache
+    pubg.api.API_URL = f"http://{host}:{port}{API_PREFIX}"
+    pubg.api.TELEMETRY_URL = f"http://{host}:{port}"
+    pubg.api.client.cache = None
+    try:
+        yield server
+    finally:
+        pubg.api.API_URL, pubg.api.TELEMETRY_URL, pubg.api.client.cache = saved
+        server.shutdown()
+        server.server_close()
+
+
+def populate(
+    nb_players: int,
+    nb_matches: int,
+    seed: int = 0,
+    telemetry_events: int = 2000,
+    with_telemetry: bool = True,
+    progress: bool = False,
+) -> list[str]:
+    """
+    Ingest synthetic matches through the same code path as real ones: they are served by a
+    local FakeAPIServer and ingested by the job queue. Returns the IDs of the ingested matches.
+    Player stats and killscores are up to date afterwards
+    """
+    Player.objects.update_or_create(
+        id=FORSEN_PLAYERID, defaults={"name": "forsen", "is_forsen": True}
+    )
+    matches = SyntheticMatches(nb_players, seed, telemetry_events if with_telemetry else 0)
+    with tempfile.TemporaryDirectory() as fixtures:
+        store = FixtureStore(fixtures)
+        match_ids = []
+        for match_id, match_info, telemetry_data in tqdm(
+            itertools.islice(matches, nb_matches), total=nb_matches, disable=not progress
+        ):
+            if with_telemetry:
+                store.save_telemetry(Match.get_telemetry_url(match_info), telemetry_data)
+            else:
+                match_info["included"] = [
+                    entry for entry in match_info["included"] if entry["type"] != "asset"
+                ]
+            store.save_match(match_id, match_info)
+            match_ids.append(match_id)
+
+        Match.objects.bulk_create([Match(id=match_id) for match_id in match_ids])
+        IngestJob.objects.bulk_create([IngestJob(match_id=match_id) for match_id in match_ids])
+        with fake_api(store):
+            ingested_match_ids = run_jobs()
+    Website.publish()
+    return ingested_match_ids
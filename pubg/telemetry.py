@@ -0,0 +1,318 @@
+import io
+import json
+import re
+from dataclasses import dataclass, field
+from typing import BinaryIO, Iterator, NamedTuple
+
+import pubg.compression
+from pubg import FORSEN_PLAYERID
+
+CHUNK_SIZE = 64 * 1024
+# Bytes read without finding the end of an event before giving up on the "_T" layout
+MAX_UNMARKED_SIZE = 16 * CHUNK_SIZE
+
+_decoder = json.JSONDecoder()
+_separators = re.compile(r"[\s,\[]*")
+
+
+def iter_events(fileobj: BinaryIO) -> Iterator[dict]:
+    """
+    Incrementally parse a telemetry document (a JSON array of events) from a binary file
+    Events are yielded one at a time: only the current event and one chunk of text are in
+    memory, and the rest of the file is never read if the caller stops iterating
+    """
+    text = io.TextIOWrapper(fileobj, encoding="utf-8")
+    buffer = ""
+    pos = 0
+    eof = False
+    while True:
+        pos = _separators.match(buffer, pos).end()
+        if pos < len(buffer) and buffer[pos] == "]":
+            return
+        if pos < len(buffer):
+            try:
+                telemetry_obj, pos = _decoder.raw_decode(buffer, pos)
+                yield telemetry_obj
+                continue
+            except json.JSONDecodeError:
+                # The event is cut at the end of the buffer, or the document is invalid
+                if eof:
+                    raise
+        elif eof:
+            return
+
+        chunk = text.read(CHUNK_SIZE)
+        eof = not chunk
+        buffer = buffer[pos:] + chunk
+        pos = 0
+
+
+# PUBG writes the event type as the last key of every event: `"_T":"LogXxx"}` marks the end
+# of an event, and nested objects never have a "_T" key
+_event_end = re.compile(rb'"_T"\s*:\s*"(\w+)"\s*}')
+
+
+class _PrefixedStream(io.RawIOBase):
+    """Binary stream reading `prefix`, then the rest of `fileobj`"""
+
+    def __init__(self, prefix: bytes, fileobj: BinaryIO):
+        self.prefix = memoryview(prefix)
+        self.fileobj = fileobj
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, b) -> int:
+        if not self.prefix:
+            data = self.fileobj.read(len(b))
+            b[: len(data)] = data
+            return len(data)
+        size = min(len(b), len(self.prefix))
+        b[:size] = self.prefix[:size]
+        self.prefix = self.prefix[size:]
+        return size
+
+
+def _last_event_end(buffer: bytes, end: int) -> int:
+    """Position right after the last complete event in buffer[:end], 0 if there is none"""
+    while (marker := buffer.rfind(b'"_T"', 0, end)) != -1:
+        if m := _event_end.match(buffer, marker):
+            return m.end()
+        end = marker
+    return 0
+
+
+def iter_matching_events(fileobj: BinaryIO, needle: bytes, event_types: set) -> Iterator[dict]:
+    """
+    Yield the events of one of `event_types` whose raw text contains `needle`, in order
+    Events are split on their "_T" marker at the byte level and only the candidates are
+    decoded: everything else is skipped without being parsed into Python objects
+    If the telemetry does not have the expected layout, this falls back to parsing every
+    remaining event and only filtering on the event type
+    """
+    wanted = {event_type.encode() for event_type in event_types}
+    buffer = b""
+    eof = False
+    while not eof:
+        chunk = fileobj.read(CHUNK_SIZE)
+        eof = not chunk
+        buffer += chunk
+        cut = _last_event_end(buffer, len(buffer))
+        if not cut:
+            if len(buffer) > MAX_UNMARKED_SIZE:
+                # Not the expected layout: stream the rest instead of buffering all of it
+                break
+            continue
+
+        hit = buffer.find(needle, 0, cut)
+        while hit != -1:
+            m = _event_end.search(buffer, hit, cut)
+            if m is None:
+                break
+            if m.group(1) in wanted:
+                start = _last_event_end(buffer, hit)
+                yield from iter_events(io.BytesIO(buffer[start : m.end()]))
+            hit = buffer.find(needle, m.end(), cut)
+        buffer = buffer[cut:]
+
+    rest = io.BufferedReader(_PrefixedStream(buffer, fileobj), CHUNK_SIZE)
+    for telemetry_obj in iter_events(rest):
+        if telemetry_obj["_T"] in event_types:
+            yield telemetry_obj
+
+
+class Event(NamedTuple):
+    """
+    Compact version of a telemetry event involving forsen, stored as a ForsenEvent row
+    """
+
+    type: str  # "_T" of the telemetry event
+    timestamp: str | None
+    account_id: str | None  # Attacker, killer or character riding the vehicle
+    victim_account_id: str | None
+    damage: float | None
+    damage_type_category: str | None
+    rank: int | None  # Rank of the victim
+    is_suicide: bool = False
+
+    @classmethod
+    def from_telemetry(cls, telemetry_obj: dict) -> "Event":
+        match telemetry_obj["_T"]:
+            case "LogPlayerKillV2":
+                killer = telemetry_obj["killer"]
+                return cls(
+                    telemetry_obj["_T"],
+                    telemetry_obj.get("_D"),
+                    killer.get("accountId") if killer else None,
+                    telemetry_obj["victim"]["accountId"],
+                    None,
+                    telemetry_obj["killerDamageInfo"]["damageTypeCategory"],
+                    (telemetry_obj.get("victimGameResult") or {}).get("rank"),
+                    telemetry_obj["isSuicide"],
+                )
+            case "LogPlayerTakeDamage":
+                attacker = telemetry_obj["attacker"]
+                return cls(
+                    telemetry_obj["_T"],
+                    telemetry_obj.get("_D"),
+                    attacker["accountId"] if attacker else None,
+                    telemetry_obj["victim"]["accountId"],
+                    telemetry_obj["damage"],
+                    telemetry_obj["damageTypeCategory"],
+                    None,
+                )
+            case "LogVehicleRide":
+                return cls(
+                    telemetry_obj["_T"],
+                    telemetry_obj.get("_D"),
+                    telemetry_obj["character"]["accountId"],
+                    None,
+                    None,
+                    None,
+                    None,
+                )
+            case _:
+                raise ValueError(f"Type {telemetry_obj['_T']} is not handled")
+
+
+@dataclass
+class TelemetryStats:
+    """
+    Stats of one match computed from its forsen events, without touching the database
+    Match fields left to None were not seen in the telemetry and are kept as they are
+    Per-player dicts are keyed by account ID
+    """
+
+    events: list[Event] = field(default_factory=list)
+    forsen_died_to_cause: str | None = None
+    forsen_died_to_account: str | None = None
+    forsen_final_rank: int | None = None
+    forsen_killer: str | None = None
+    nb_forsen_kills: int = 0
+    nb_forsen_bot_kills: int = 0
+    damage_to_forsen: dict[str, int] = field(default_factory=dict)
+    killed_forsen_with: dict[str, str] = field(default_factory=dict)
+    killed_by_forsen_with: dict[str, str] = field(default_factory=dict)
+
+    @classmethod
+    def from_events(cls, events) -> "TelemetryStats":
+        stats = cls()
+        for event in events:
+            stats.add(event)
+        return stats
+
+    def add(self, event: Event):
+        self.events.append(event)
+        match event.type:
+            case "LogPlayerKillV2":
+                self.add_LogPlayerKillV2(event)
+            case "LogPlayerTakeDamage":
+                self.add_LogPlayerTakeDamage(event)
+            case "LogVehicleRide":
+                self.add_LogVehicleRide(event)
+
+    def add_LogPlayerKillV2(self, event: Event):
+        damage_type_category = event.damage_type_category
+        if damage_type_category == "Damage_Explosion_StickyBomb":
+            damage_type_category = "Damage_Explosion_C4"
+        self.forsen_died_to_cause = damage_type_category
+
+        victim_accountid = event.victim_account_id
+        if victim_accountid.startswith("npc."):
+            return
+        if victim_accountid.startswith("ai."):
+            self.nb_forsen_bot_kills += 1
+            self.nb_forsen_kills += 1
+            return
+
+        if event.is_suicide:
+            # Forsen killed himself LUL
+            self.killed_by_forsen_with[victim_accountid] = damage_type_category
+            self.killed_forsen_with[victim_accountid] = damage_type_category
+            return
+
+        if victim_accountid == FORSEN_PLAYERID:
+            self.forsen_final_rank = event.rank
+            if event.account_id:
+                killer_accountid = event.account_id
+            else:
+                # Died to e.g vehicle without driver
+                return
+            self.forsen_died_to_account = killer_accountid
+            if killer_accountid.startswith("npc.") or killer_accountid.startswith("ai."):
+                return
+            self.forsen_killer = killer_accountid
+            self.killed_forsen_with[killer_accountid] = damage_type_category
+        else:  # killer is forsen
+            self.nb_forsen_kills += 1
+            self.killed_by_forsen_with[victim_accountid] = damage_type_category
+
+    def add_LogPlayerTakeDamage(self, event: Event):
+        if event.account_id is None:
+            # Forsen damaged himself LUL
+            return
+
+        attacker_accountid = event.account_id
+        if attacker_accountid.startswith("ai.") or attacker_accountid.startswith("npc."):
+            return
+
+        # Damage used to be stored in an integer column after every hit, keep truncating it
+        damage = self.damage_to_forsen.get(attacker_accountid, 0) + event.damage
+        self.damage_to_forsen[attacker_accountid] = int(damage)
+
+    def add_LogVehicleRide(self, event: Event):
+        pass
+
+
+def attacker_is_forsen(telemetry_obj: dict) -> bool:
+    attacker = telemetry_obj.get("attacker") or telemetry_obj.get("killer")
+    return attacker is not None and attacker["accountId"] == FORSEN_PLAYERID
+
+
+def victim_is_forsen(telemetry_obj: dict) -> bool:
+    return telemetry_obj["victim"]["accountId"] == FORSEN_PLAYERID
+
+
+def is_forsen_related(telemetry_obj: dict) -> bool:
+    if (fellow_passengers := telemetry_obj.get("fellowPassengers")) is not None:
+        # LogVehicleRide
+        return telemetry_obj["character"]["accountId"] == FORSEN_PLAYERID or any(
+            [passenger["accountId"] == FORSEN_PLAYERID for passenger in fellow_passengers]
+        )
+    return attacker_is_forsen(telemetry_obj) or victim_is_forsen(telemetry_obj)
+
+
+def extract_events(fileobj: BinaryIO) -> Iterator[Event]:
+    """
+    Extract the events involving forsen from the decompressed telemetry of a match
+    Only events mentioning forsen are parsed, and nothing after his death is ever read
+    """
+    telemetry_objs = iter_matching_events(
+        fileobj,
+        FORSEN_PLAYERID.encode(),
+        {"LogPlayerKillV2", "LogPlayerTakeDamage", "LogVehicleRide"},
+    )
+    for telemetry_obj in telemetry_objs:
+        match telemetry_obj["_T"]:
+            case "LogPlayerKillV2" if is_forsen_related(telemetry_obj):
+                yield Event.from_telemetry(telemetry_obj)
+                if victim_is_forsen(telemetry_obj):
+                    # We don't care about stats after forsen dies
+                    return
+            case "LogPlayerTakeDamage" if victim_is_forsen(telemetry_obj):
+                yield Event.from_telemetry(telemetry_obj)
+            case "LogVehicleRide" if is_forsen_related(telemetry_obj):
+                yield Event.from_telemetry(telemetry_obj)
+
+
+def extract_stats(fileobj: BinaryIO) -> TelemetryStats:
+    """Extract the forsen events and the stats of a match from its decompressed telemetry"""
+    return TelemetryStats.from_events(extract_events(fileobj))
+
+
+def extract_stats_from_blob(blob: bytes) -> TelemetryStats:
+    """
+    Extract the stats of a match from its stored telemetry blob
+    Doesn't need the database, so it can run in a worker process
+    """
+    return extract_stats(pubg.compression.open_blob(blob))
@@ -1,3 +1,417 @@
-from django.test import TestCase
+import base64
+import datetime
+import io
+import json
+import random
+import tempfile
+from pathlib import Path
+from unittest import mock
 
-# Create your tests here.
+from django.core.cache import caches
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+import pubg.telemetry
+from pubg import FORSEN_PLAYERID
+from pubg.fakeapi import FixtureStore
+from pubg.ingest import LEASE_DURATION, run_jobs
+from pubg.models import (
+    IngestJob,
+    LeaderboardSnapshot,
+    LeaseLost,
+    Match,
+    Player,
+    PlayerNameTrigram,
+    Website,
+)
+from pubg.synthetic import SyntheticMatches, character, event, fake_api
+from pubg.telemetry import extract_events, iter_matching_events
+from pubg.views import keyset_after
+
+FORSEN = character(FORSEN_PLAYERID, "Forsen")
+SNIPER = character("account.sniper", "Sniper")
+
+
+def telemetry(*events) -> io.BytesIO:
+    return io.BytesIO(json.dumps(list(events)).encode())
+
+
+def baseline_events(document: bytes) -> list[pubg.telemetry.Event]:
+    """What extract_events must return, computed by parsing the whole document"""
+    events = []
+    for telemetry_obj in json.loads(document):
+        match telemetry_obj["_T"]:
+            case "LogPlayerKillV2" if pubg.telemetry.is_forsen_related(telemetry_obj):
+                events.append(pubg.telemetry.Event.from_telemetry(telemetry_obj))
+                if pubg.telemetry.victim_is_forsen(telemetry_obj):
+                    break
+            case "LogPlayerTakeDamage" if pubg.telemetry.victim_is_forsen(telemetry_obj):
+                events.append(pubg.telemetry.Event.from_telemetry(telemetry_obj))
+            case "LogVehicleRide" if pubg.telemetry.is_forsen_related(telemetry_obj):
+                events.append(pubg.telemetry.Event.from_telemetry(telemetry_obj))
+    return events
+
+
+class IterMatchingEventsTests(SimpleTestCase):
+    def setUp(self):
+        timestamp = datetime.datetime(2022, 1, 1)
+        self.position = event("LogPlayerPosition", timestamp, character=FORSEN)
+        self.ride = event("LogVehicleRide", timestamp, character=FORSEN, fellowPassengers=[])
+        self.other_ride = event("LogVehicleRide", timestamp, character=SNIPER, fellowPassengers=[])
+        self.damage = event(
+            "LogPlayerTakeDamage",
+            timestamp,
+            attacker=SNIPER,
+            victim=FORSEN,
+            damageTypeCategory="Damage_Gun",
+            damage=12.5,
+        )
+
+    def matching(self, fileobj, event_types=("LogVehicleRide", "LogPlayerTakeDamage")):
+        return iter_matching_events(fileobj, FORSEN_PLAYERID.encode(), set(event_types))
+
+    def test_only_wanted_events_with_the_needle(self):
+        document = telemetry(self.position, self.other_ride, self.ride, self.damage)
+        self.assertEqual(list(self.matching(document)), [self.ride, self.damage])
+
+    def test_nested_objects_are_part_of_their_event(self):
+        # The needle is in a nested object, the event still ends at its own "_T"
+        document = telemetry(self.other_ride, self.damage, self.position)
+        self.assertEqual(list(self.matching(document, ["LogPlayerTakeDamage"])), [self.damage])
+
+    def test_events_split_across_chunks(self):
+        events = [self.position, self.ride, self.other_ride, self.damage] * 5
+        expected = [self.ride, self.damage] * 5
+        for chunk_size in (1, 2, 7, 31, 64):
+            with self.subTest(chunk_size=chunk_size), mock.patch.object(
+                pubg.telemetry, "CHUNK_SIZE", chunk_size
+            ):
+                self.assertEqual(list(self.matching(telemetry(*events))), expected)
+
+    def test_whitespace_around_the_marker(self):
+        document = json.dumps([self.position, self.ride], indent=2).encode()
+        self.assertEqual(list(self.matching(io.BytesIO(document))), [self.ride])
+
+    def test_falls_back_without_the_expected_layout(self):
+        # "_T" is the first key of every event once sorted, so no event end is ever found
+        document = json.dumps([self.position, self.ride, self.damage] * 50, sort_keys=True)
+        with mock.patch.object(pubg.telemetry, "MAX_UNMARKED_SIZE", 100):
+            events = list(self.matching(io.BytesIO(document.encode())))
+        self.assertEqual(events, [self.ride, self.damage] * 50)
+
+    def test_fallback_does_not_read_the_whole_document(self):
+        document = json.dumps([self.ride] * 5000, sort_keys=True).encode()
+        fileobj = io.BytesIO(document)
+        with mock.patch.object(pubg.telemetry, "MAX_UNMARKED_SIZE", 1000):
+            self.assertEqual(next(self.matching(fileobj)), self.ride)
+        self.assertLess(fileobj.tell(), len(document))
+
+
+class ExtractEventsTests(SimpleTestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        matches = SyntheticMatches(100, seed=3, telemetry_events=300)
+        cls.documents = [matches.generate_match()[2] for _ in range(60)]
+
+    def test_same_events_as_parsing_everything(self):
+        for chunk_size in (pubg.telemetry.CHUNK_SIZE, 7):
+            with mock.patch.object(pubg.telemetry, "CHUNK_SIZE", chunk_size):
+                for i, document in enumerate(self.documents):
+                    with self.subTest(chunk_size=chunk_size, document=i):
+                        self.assertEqual(
+                            list(extract_events(io.BytesIO(document))), baseline_events(document)
+                        )
+
+    def test_stops_reading_after_forsen_died(self):
+        document = self.documents[0]
+        death_end = document.index(b"}", document.rindex(b'"_T": "LogPlayerKillV2"')) + 1
+        # Anything after forsen's death, even invalid JSON, is never parsed
+        corrupted = document[:death_end] + b", garbage" * 10000 + document[death_end:]
+        self.assertEqual(list(extract_events(io.BytesIO(corrupted))), baseline_events(document))
+
+
+class IngestJobTests(TestCase):
+    def setUp(self):
+        Match.objects.bulk_create([Match(id=f"match-{i}") for i in range(5)])
+        IngestJob.objects.bulk_create([IngestJob(match_id=f"match-{i}") for i in range(5)])
+
+    def lease(self, worker: str, count: int = 10) -> list[IngestJob]:
+        return IngestJob.lease(worker, count, LEASE_DURATION)
+
+    def assertDelay(self, job: IngestJob, delay: datetime.timedelta):
+        job.refresh_from_db()
+        expected = timezone.now() + delay
+        self.assertAlmostEqual(job.next_attempt_at, expected, delta=datetime.timedelta(seconds=5))
+
+    def test_lease_only_due_jobs(self):
+        IngestJob.objects.filter(match_id="match-0").update(state=IngestJob.DONE)
+        IngestJob.objects.filter(match_id="match-1").update(
+            next_attempt_at=timezone.now() + datetime.timedelta(minutes=1)
+        )
+        leased = self.lease("worker-a")
+        self.assertEqual({job.match_id for job in leased}, {"match-2", "match-3", "match-4"})
+        self.assertTrue(all(job.leased_by == "worker-a" for job in leased))
+
+    def test_lease_count(self):
+        self.assertEqual(len(self.lease("worker-a", 2)), 2)
+        self.assertEqual(len(self.lease("worker-b", 10)), 3)
+
+    def test_leased_jobs_have_one_owner(self):
+        self.assertEqual(len(self.lease("worker-a")), 5)
+        self.assertEqual(self.lease("worker-b"), [])
+
+    def test_expired_lease_is_taken_over(self):
+        [job] = self.lease("worker-a", 1)
+        IngestJob.objects.filter(pk=job.pk).update(
+            lease_expires_at=timezone.now() - datetime.timedelta(seconds=1)
+        )
+        [taken_over] = self.lease("worker-b", 1)
+        self.assertEqual(taken_over.pk, job.pk)
+        self.assertEqual(taken_over.leased_by, "worker-b")
+
+        # The first worker comes back and can't record anything anymore
+        with self.assertRaises(LeaseLost):
+            job.fail("Timeout")
+        taken_over.refresh_from_db()
+        self.assertEqual((taken_over.attempts, taken_over.leased_by), (0, "worker-b"))
+
+    def test_finish_attempt_releases_the_lease(self):
+        [job] = self.lease("worker-a", 1)
+        job._finish_attempt(state=IngestJob.DONE)
+        job.refresh_from_db()
+        self.assertEqual((job.state, job.attempts), (IngestJob.DONE, 1))
+        self.assertIsNone(job.leased_by)
+        self.assertIsNone(job.lease_expires_at)
+        self.assertNotIn(job.pk, [leased.pk for leased in self.lease("worker-b")])
+
+    def test_finish_attempt_moves_to_the_telemetry_stage(self):
+        [job] = self.lease("worker-a", 1)
+        job.telemetry_url = "https://telemetry-cdn.pubg.com/match.json"
+        job._finish_attempt("Could not get telemetry", stage=IngestJob.STAGE_TELEMETRY, retry=True)
+        job.refresh_from_db()
+        self.assertEqual(job.state, IngestJob.PENDING)
+        self.assertEqual(job.stage, IngestJob.STAGE_TELEMETRY)
+        self.assertEqual(job.telemetry_url, "https://telemetry-cdn.pubg.com/match.json")
+        self.assertEqual(job.last_error, "Could not get telemetry")
+        self.assertDelay(job, IngestJob.RETRY_DELAY)
+
+    def test_retry_backs_off_exponentially(self):
+        IngestJob.objects.exclude(match_id="match-0").delete()
+        for attempt in range(1, 4):
+            IngestJob.objects.update(next_attempt_at=timezone.now())
+            [job] = self.lease("worker-a")
+            job.fail("HTTP 500")
+            self.assertEqual(job.attempts, attempt)
+            self.assertEqual(job.state, IngestJob.PENDING)
+            self.assertDelay(job, IngestJob.RETRY_DELAY * 2 ** (attempt - 1))
+
+    def test_retry_gives_up_after_max_attempts(self):
+        IngestJob.objects.exclude(match_id="match-0").delete()
+        IngestJob.objects.update(attempts=IngestJob.MAX_ATTEMPTS - 1)
+        [job] = self.lease("worker-a")
+        job.fail("HTTP 500")
+        self.assertEqual(job.state, IngestJob.FAILED)
+        # 2**9 minutes is longer than the maximum delay
+        self.assertDelay(job, IngestJob.MAX_RETRY_DELAY)
+        IngestJob.objects.update(next_attempt_at=timezone.now())
+        self.assertEqual(self.lease("worker-b"), [])
+
+
+class RunJobsTests(TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.store = FixtureStore(directory.name)
+        match_id, match_info, telemetry_data = SyntheticMatches(20).generate_match()
+        self.store.save_match(match_id, match_info)
+        self.store.save_telemetry(Match.get_telemetry_url(match_info), telemetry_data)
+        self.match_id = match_id
+        # A response that isn't JSON, and one without the expected structure
+        self.store.match_path("invalid-body").write_bytes(b"<html>Bad gateway</html>")
+        self.store.save_match("invalid-match", {"data": {}})
+        match_ids = [match_id, "invalid-body", "invalid-match"]
+        Match.objects.bulk_create([Match(id=match_id) for match_id in match_ids])
+        IngestJob.objects.bulk_create([IngestJob(match_id=match_id) for match_id in match_ids])
+
+    def test_invalid_responses_fail_their_job_only(self):
+        with fake_api(self.store):
+            self.assertEqual(run_jobs(workers=2), [self.match_id])
+
+        self.assertEqual(IngestJob.objects.get(match_id=self.match_id).state, IngestJob.DONE)
+        for match_id in ("invalid-body", "invalid-match"):
+            with self.subTest(match_id=match_id):
+                job = IngestJob.objects.get(match_id=match_id)
+                self.assertEqual((job.state, job.attempts), (IngestJob.PENDING, 1))
+                self.assertIsNone(job.leased_by)
+                self.assertGreater(job.next_attempt_at, timezone.now())
+                self.assertTrue(job.last_error)
+
+
+class PlayerSearchTests(TestCase):
+    def setUp(self):
+        names = ["forsenSniper", "xX_FORSEN_Xx", "LidlSnajper", "sen_rse", "Baj"]
+        self.players = Player.objects.bulk_create(
+            [Player(id=f"account.{i}", name=name) for i, name in enumerate(names)]
+        )
+        PlayerNameTrigram.index(self.players)
+
+    def search(self, query: str) -> set[str]:
+        return set(Player.objects.search(query).values_list("name", flat=True))
+
+    def test_substring_case_insensitive(self):
+        self.assertEqual(self.search("forsen"), {"forsenSniper", "xX_FORSEN_Xx"})
+        self.assertEqual(self.search("SNI"), {"forsenSniper"})
+        self.assertEqual(self.search("lidlsnajper"), {"LidlSnajper"})
+
+    def test_every_trigram_in_the_wrong_order(self):
+        # "sen_rse" has both trigrams of "rsen", but doesn't contain it
+        self.assertEqual(self.search("rsen"), {"forsenSniper", "xX_FORSEN_Xx"})
+
+    def test_short_queries(self):
+        self.assertEqual(self.search("aj"), {"LidlSnajper", "Baj"})
+        self.assertEqual(self.search("x"), {"xX_FORSEN_Xx"})
+
+    def test_no_match(self):
+        self.assertEqual(self.search("okayeg"), set())
+
+    def test_renamed_player(self):
+        player = self.players[0]
+        player.name = "Okayeg"
+        player.save()
+        self.assertEqual(self.search("forsen"), {"xX_FORSEN_Xx"})
+        self.assertEqual(self.search("kaye"), {"Okayeg"})
+
+    def test_created_player(self):
+        Player.objects.create(id="account.new", name="forsenE")
+        self.assertEqual(self.search("forsen"), {"forsenSniper", "xX_FORSEN_Xx", "forsenE"})
+
+    def test_save_other_fields(self):
+        player = self.players[1]
+        player.kills = 3
+        player.save(update_fields=["kills"])
+        self.assertEqual(self.search("forsen"), {"forsenSniper", "xX_FORSEN_Xx"})
+
+
+class KeysetPaginationTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        # Few distinct values, so that every ranking has ties on its first keys
+        rnd = random.Random(0)
+        players = []
+        for i in range(60):
+            player = Player(
+                id=f"account.{i:02}",
+                name=f"Player{i}",
+                kills=rnd.randint(0, 8),
+                deaths=rnd.randint(0, 8),
+                games_sniped=rnd.randint(1, 4),
+                killscore=rnd.choice([0, 10000, 20000]),
+            )
+            player.update_ratios()
+            players.append(player)
+        Player.objects.bulk_create(players)
+
+    def setUp(self):
+        # Keep the pages and the generation stamp of the tests out of the website's
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        # A location of its own for each test, locmem caches are shared by location
+        locmem = {
+            "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+            "LOCATION": directory.name,
+        }
+        settings = override_settings(
+            CACHES={"default": locmem, "pages": {**locmem, "LOCATION": f"{directory.name}/pages"}},
+            GENERATION_STAMP_FILE=Path(directory.name) / "generation",
+        )
+        settings.enable()
+        self.addCleanup(settings.disable)
+        Website._cached = None
+        self.addCleanup(setattr, Website, "_cached", None)
+
+    def ranking(self, ranking: str) -> list[str]:
+        order_by, only_regulars = LeaderboardSnapshot.RANKINGS[ranking]
+        players = Player.objects.regulars() if only_regulars else Player.objects.all()
+        return list(players.order_by(*order_by).values_list("id", flat=True))
+
+    def test_keyset_after(self):
+        for ranking, (order_by, only_regulars) in LeaderboardSnapshot.RANKINGS.items():
+            expected = self.ranking(ranking)
+            keys = [key.lstrip("-") for key in order_by]
+            for position in (0, len(expected) // 2, len(expected) - 1):
+                with self.subTest(ranking=ranking, position=position):
+                    values = list(Player.objects.values_list(*keys).get(id=expected[position]))
+                    players = Player.objects.regulars() if only_regulars else Player.objects
+                    after = players.filter(keyset_after(order_by, values)).order_by(*order_by)
+                    self.assertEqual(
+                        list(after.values_list("id", flat=True)), expected[position + 1 :]
+                    )
+
+    def test_pages_cover_the_ranking_once(self):
+        for ranking in LeaderboardSnapshot.RANKINGS:
+            with self.subTest(ranking=ranking):
+                url = reverse("api_leaderboard", args=[ranking]) + "?limit=7&fields=id"
+                ids = []
+                while url:
+                    response = self.client.get(url).json()
+                    self.assertLessEqual(len(response["players"]), 7)
+                    ids += [player["id"] for player in response["players"]]
+                    url = response["next"]
+                self.assertEqual(ids, self.ranking(ranking))
+
+    def test_invalid_cursors(self):
+        # The killscore ranking is ordered by killscore, then id
+        url = reverse("api_leaderboard", args=["killscore"])
+        invalid = (
+            [{"a": 1}, 1],
+            [1.5, "account.01"],
+            [1, 2],
+            [True, "account.01"],
+            [2**70, "account.01"],
+            [1, "account.01", 3],
+            "killscore",
+        )
+        for values in invalid:
+            cursor = base64.urlsafe_b64encode(json.dumps(values).encode()).decode()
+            with self.subTest(values=values):
+                response = self.client.get(url, {"after": cursor})
+                self.assertEqual(response.status_code, 400)
+                self.assertEqual(response.json(), {"error": "Invalid cursor"})
+        for cursor in ("W3siYSI6MX0sMV0", "not base64!", "e30"):
+            with self.subTest(cursor=cursor):
+                self.assertEqual(self.client.get(url, {"after": cursor}).status_code, 400)
+
+    def test_invalid_limits(self):
+        url = reverse("api_leaderboard", args=["killscore"])
+        # "²" is a digit for str.isdigit(), but not for int()
+        for limit in ("0", "101", "-5", "1.5", "ten", "", "²"):
+            with self.subTest(limit=limit):
+                response = self.client.get(url, {"limit": limit})
+                self.assertEqual(response.status_code, 400)
+                self.assertEqual(response.json(), {"error": "limit must be between 1 and 100"})
+
+    def test_equivalent_queries_share_a_cached_page(self):
+        url = reverse("api_leaderboard", args=["killscore"])
+        first = self.client.get(url, {"fields": "name,id", "limit": "07", "utm_source": "x"})
+        second = self.client.get(url, {"limit": "7", "fields": "id,name,id"})
+        self.assertEqual(first.content, second.content)
+        self.assertEqual(len(caches["pages"]._cache), 1)
+        self.assertEqual(list(first.json()["players"][0]), ["id", "name"])
+        self.assertNotIn("utm_source", first.json()["next"])
+
+    def test_rejected_queries_are_not_cached(self):
+        url = reverse("api_leaderboard", args=["killscore"])
+        for query in ({"limit": "1000"}, {"limit": "ten"}, {"fields": "id,password"}):
+            with self.subTest(query=query):
+                self.assertEqual(self.client.get(url, query).status_code, 400)
+        self.assertEqual(len(caches["pages"]._cache), 0)
+
+    def test_integer_cursor_for_a_ratio(self):
+        # JSON doesn't keep 1.0 apart from 1
+        response = self.client.get(
+            reverse("api_leaderboard", args=["best_kd"]),
+            {"after": base64.urlsafe_b64encode(b'[1, 2, "account.00"]').decode()},
+        )
+        self.assertEqual(response.status_code, 200)
@@ -8,5 +8,8 @@ urlpatterns = [
     path("rankings/", views.all_rankings_view, name="index"),
     path("player_list/", views.all_rankings_view, name="player_list"),
     path("search/", views.player_search, name="player_search"),
+    path("search/autocomplete/", views.player_autocomplete, name="player_autocomplete"),
     path("player/<account_id>/", views.player_view, name="player_view"),
+    path("api/leaderboards/<ranking>/", views.api_leaderboard, name="api_leaderboard"),
+    path("api/players/<account_id>/", views.api_player, name="api_player"),
 ]
@@ -1,17 +1,84 @@
+import base64
+import datetime
+import json
+import math
+from functools import wraps
+from django.conf import settings
 from django.contrib import messages
+from django.core.cache import caches
 from django.core.paginator import Paginator
-from django.db.models import Avg, Case, F, FloatField, ExpressionWrapper, When
-from django.http import HttpResponseNotAllowed, HttpResponseRedirect
+from django.db.models import Case, FloatField, IntegerField, Q, When
+from django.http import (
+    HttpResponse,
+    HttpResponseNotAllowed,
+    HttpResponseRedirect,
+    JsonResponse,
+    QueryDict,
+)
 from django.shortcuts import render
 from django.templatetags.static import static
+from django.utils.cache import patch_cache_control
 from django.utils.safestring import mark_safe
+from django.views.decorators.http import condition
 from django.views.generic.base import TemplateView
 
 import django_tables2 as tables
 
 from pubg import WEAPON_KILLSCORE_MULTIPLIERS, WEAPON_ICON_NAMES, WEAPON_NAMES
 from pubg.forms import PlayerSearchForm
-from pubg.models import Match, Player, PlayerMatchStats
+from pubg.live import LIVE_PATH
+from pubg.models import LeaderboardSnapshot, Match, Player, Website
+
+
+def cache_page_by_generation(**params):
+    """
+    Cache the pages of a view until the stats change: pages are stored in the shared "pages"
+    cache under the version of the current generation, and conditional GETs get a 304 Not
+    Modified thanks to ETag and Last-Modified headers
+    The view only sees the query parameters named in `params`, normalized by their function,
+    so that equivalent URLs share a page and made-up parameters can't fill the cache. A
+    parameter that doesn't normalize (ValueError) is left for the view to reject, uncached
+    """
+
+    def decorator(view):
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            website = Website.cached()
+            version, last_update = website.version, website.last_update
+
+            def cached_view(request, *args, **kwargs):
+                query = QueryDict(mutable=True)
+                query.update({name: request.GET[name] for name in params if name in request.GET})
+                request.GET = query
+                # Pending messages are shown on the page, so it must be rendered for this visitor
+                if request.method not in ("GET", "HEAD") or messages.get_messages(request):
+                    return view(request, *args, **kwargs)
+                try:
+                    for name, value in query.items():
+                        query[name] = params[name](value)
+                except ValueError:
+                    return view(request, *args, **kwargs)
+
+                key = f"{version}:{request.path}?{query.urlencode()}"
+                if (cached := caches["pages"].get(key)) is not None:
+                    content, content_type = cached
+                    return HttpResponse(content, content_type=content_type)
+                response = view(request, *args, **kwargs)
+                if response.status_code == 200:
+                    caches["pages"].set(key, (response.content, response["Content-Type"]))
+                return response
+
+            response = condition(
+                etag_func=lambda *_, **__: f'"{version}"',
+                last_modified_func=lambda *_, **__: last_update,
+            )(cached_view)(request, *args, **kwargs)
+            # Browsers must revalidate, the page changes with every generation
+            patch_cache_control(response, no_cache=True)
+            return response
+
+        return wrapper
+
+    return decorator
 
 
 class OnePagePaginator(Paginator):
@@ -59,63 +126,6 @@ class PlayerKillScoreTable(ClickableRowTable):
     )
     gun = tables.Column(get_icon_html("Damage_Gun"), empty_values=())
 
-    def __init__(self, *args, **kwargs):
-        super().__init__(*args, **kwargs)
-
-    def render_vehicle_explosion(self, **kwargs):
-        player = kwargs["record"]
-        return PlayerMatchStats.objects.filter(
-            player=player, killed_forsen_with="Damage_Explosion_Vehicle"
-        ).count()
-
-    def render_punch(self, **kwargs):
-        player = kwargs["record"]
-        return PlayerMatchStats.objects.filter(
-            player=player, killed_forsen_with__in=("Damage_Punch", "Damage_Melee")
-        ).count()
-
-    def render_c4(self, **kwargs):
-        player = kwargs["record"]
-        return PlayerMatchStats.objects.filter(
-            player=player, killed_forsen_with="Damage_Explosion_C4"
-        ).count()
-
-    def render_molotov(self, **kwargs):
-        player = kwargs["record"]
-        return PlayerMatchStats.objects.filter(
-            player=player, killed_forsen_with="Damage_Molotov"
-        ).count()
-
-    def render_grenade(self, **kwargs):
-        player = kwargs["record"]
-        return PlayerMatchStats.objects.filter(
-            player=player, killed_forsen_with="Damage_Explosion_Grenade"
-        ).count()
-
-    def render_throw(self, **kwargs):
-        player = kwargs["record"]
-        return PlayerMatchStats.objects.filter(
-            player=player, killed_forsen_with="Damage_MeleeThrow"
-        ).count()
-
-    def render_vehicle(self, **kwargs):
-        player = kwargs["record"]
-        return PlayerMatchStats.objects.filter(
-            player=player, killed_forsen_with="Damage_VehicleHit"
-        ).count()
-
-    def render_panzerfaust(self, **kwargs):
-        player = kwargs["record"]
-        return PlayerMatchStats.objects.filter(
-            player=player, killed_forsen_with="Damage_Explosion_PanzerFaustWarhead"
-        ).count()
-
-    def render_gun(self, **kwargs):
-        player = kwargs["record"]
-        return PlayerMatchStats.objects.filter(
-            player=player, killed_forsen_with="Damage_Gun"
-        ).count()
-
     # def render_avg(self, **kwargs):
     #    player = kwargs['record']
     #    avg = PlayerMatchStats.objects.filter(player=player, killscore__gt=0).aggregate(Avg('forsen_final_rank'))['forsen_final_rank__avg']
@@ -130,7 +140,17 @@ class PlayerKillScoreTable(ClickableRowTable):
 
     class Meta:
         model = Player
-        exclude = ("id", "is_forsen", "deaths", "games_sniped")
+        exclude = (
+            "id",
+            "is_forsen",
+            "name_updated_at",
+            "deaths",
+            "games_sniped",
+            "kd",
+            "dpg",
+            "kpg",
+            "eligible",
+        )
         sequence = ("name", "killscore", "...", "kills")
 
 
@@ -147,20 +167,18 @@ class PlayerKDTable(ClickableRowTable):
         player = kwargs["record"]
         return f"{0 if player.deaths == 0 else player.kills / player.deaths:.2f}"
 
-    def order_kd(self, queryset, is_descending):
-        queryset = queryset.annotate(
-            kd=Case(
-                When(deaths=0, then=0.0),
-                default=ExpressionWrapper(
-                    F("kills") * 1.0 / F("deaths"), output_field=FloatField()
-                ),
-            )
-        ).order_by(("-" if is_descending else "") + "kd", "-deaths")
-        return queryset, True
-
     class Meta:
         model = Player
-        exclude = ("id", "is_forsen", "games_sniped", "killscore")
+        exclude = (
+            "id",
+            "is_forsen",
+            "name_updated_at",
+            "games_sniped",
+            "killscore",
+            "dpg",
+            "kpg",
+            "eligible",
+        )
 
 
 class PlayerDeathTable(ClickableRowTable):
@@ -176,20 +194,18 @@ class PlayerDeathTable(ClickableRowTable):
         player = kwargs["record"]
         return f"{0 if player.games_sniped == 0 else player.deaths / player.games_sniped:.2f}"
 
-    def order_dpg(self, queryset, is_descending):
-        queryset = queryset.annotate(
-            dpg=Case(
-                When(games_sniped=0, then=0.0),
-                default=ExpressionWrapper(
-                    F("deaths") * 1.0 / F("games_sniped"), output_field=FloatField()
-                ),
-            )
-        ).order_by(("-" if is_descending else "") + "dpg")
-        return queryset, True
-
     class Meta:
         model = Player
-        exclude = ("id", "is_forsen", "kills", "killscore")
+        exclude = (
+            "id",
+            "is_forsen",
+            "name_updated_at",
+            "kills",
+            "killscore",
+            "kd",
+            "kpg",
+            "eligible",
+        )
 
 
 class PlayerKillTable(ClickableRowTable):
@@ -207,76 +223,89 @@ class PlayerKillTable(ClickableRowTable):
 
         return mark_safe(f'1 in <b style="color: #f0f6fc">{gpk}</b>')
 
-    def order_kpg(self, queryset, is_descending):
-        queryset = queryset.annotate(
-            kpg=Case(
-                When(games_sniped=0, then=0.0),
-                default=ExpressionWrapper(
-                    F("kills") * 1.0 / F("games_sniped"), output_field=FloatField()
-                ),
-            )
-        ).order_by(("-" if is_descending else "") + "kpg")
-        return queryset, True
-
     class Meta:
         model = Player
-        exclude = ("id", "is_forsen", "deaths", "killscore")
+        exclude = (
+            "id",
+            "is_forsen",
+            "name_updated_at",
+            "deaths",
+            "killscore",
+            "kd",
+            "dpg",
+            "eligible",
+        )
+
 
+def snapshot_players(rows: list[dict]) -> list[Player]:
+    """Unsaved players with the fields and annotations stored in a leaderboard snapshot"""
+    players = []
+    for row in rows:
+        player = Player(**{field: row[field] for field in LeaderboardSnapshot.PLAYER_FIELDS})
+        for annotation in row.keys() - set(LeaderboardSnapshot.PLAYER_FIELDS):
+            setattr(player, annotation, row[annotation])
+        players.append(player)
+    return players
 
+
+def parse_snapshot_date(date: str | None) -> datetime.datetime | None:
+    return datetime.datetime.fromisoformat(date) if date else None
+
+
+@cache_page_by_generation()
 def all_rankings_view(request):
+    snapshot = LeaderboardSnapshot.current()
+    # There is no snapshot until the first ingestion that publishes one
+    data = snapshot.data if snapshot is not None else LeaderboardSnapshot.compute()
+    rankings = {ranking: snapshot_players(rows) for ranking, rows in data["rankings"].items()}
+
     config = tables.RequestConfig(request, paginate={"paginator_class": OnePagePaginator})
     visible = {"class": "table-container table-responsive visible"}
 
-    table_killscore = PlayerKillScoreTable(Player.objects.all(), attrs=visible)
+    table_killscore = PlayerKillScoreTable(rankings["killscore"], attrs=visible)
     table_killscore.order_by = "-killscore"
     table_killscore.orderable = False
     config.configure(table_killscore)
 
-    players_more_than_10_interactions = Player.objects.annotate(
-        interactions=(F("deaths") + F("kills"))
-    ).filter(interactions__gt=10)
-
-    table_best_kd = PlayerKDTable(players_more_than_10_interactions, attrs=visible)
+    table_best_kd = PlayerKDTable(rankings["best_kd"], attrs=visible)
     table_best_kd.order_by = "-kd"
     table_best_kd.orderable = False
     config.configure(table_best_kd)
 
-    table_worst_kd = PlayerKDTable(players_more_than_10_interactions)
+    table_worst_kd = PlayerKDTable(rankings["worst_kd"])
     table_worst_kd.order_by = "kd"
     table_worst_kd.orderable = False
     config.configure(table_worst_kd)
 
-    table_most_kills = PlayerKillTable(Player.objects.all(), exclude=("games_sniped", "kpg"))
+    table_most_kills = PlayerKillTable(rankings["most_kills"], exclude=("games_sniped", "kpg"))
     table_most_kills.order_by = "-kills"
     table_most_kills.orderable = False
     config.configure(table_most_kills)
 
-    table_most_kills_per_game = PlayerKillTable(players_more_than_10_interactions)
+    table_most_kills_per_game = PlayerKillTable(rankings["most_kills_per_game"])
     table_most_kills_per_game.order_by = "-kpg"
     table_most_kills_per_game.orderable = False
     config.configure(table_most_kills_per_game)
 
     # Deaths section
-    table_least_deaths_per_game = PlayerDeathTable(players_more_than_10_interactions, attrs=visible)
+    table_least_deaths_per_game = PlayerDeathTable(rankings["least_deaths_per_game"], attrs=visible)
     table_least_deaths_per_game.order_by = "dpg"
     table_least_deaths_per_game.orderable = False
     config.configure(table_least_deaths_per_game)
 
-    table_most_deaths_per_game = PlayerDeathTable(players_more_than_10_interactions)
+    table_most_deaths_per_game = PlayerDeathTable(rankings["most_deaths_per_game"])
     table_most_deaths_per_game.order_by = "-dpg"
     table_most_deaths_per_game.orderable = False
     config.configure(table_most_deaths_per_game)
 
-    table_most_deaths = PlayerDeathTable(
-        players_more_than_10_interactions, exclude=("games_sniped", "dpg")
-    )
+    table_most_deaths = PlayerDeathTable(rankings["most_deaths"], exclude=("games_sniped", "dpg"))
     table_most_deaths.order_by = "-deaths"
     table_most_deaths.orderable = False
     config.configure(table_most_deaths)
 
     # Games section
     table_most_games = PlayerDeathTable(
-        players_more_than_10_interactions, exclude=("deaths", "dpg"), attrs=visible
+        rankings["most_games"], exclude=("deaths", "dpg"), attrs=visible
     )
     table_most_games.order_by = "-games_sniped"
     table_most_games.orderable = False
@@ -292,29 +321,32 @@ def all_rankings_view(request):
         "table_most_deaths_per_game": table_most_deaths_per_game,
         "table_least_deaths_per_game": table_least_deaths_per_game,
         "table_most_games": table_most_games,
-        "nb_games": Match.objects.all().count(),
-        "first_game_date": Match.objects.all().order_by("created_at")[0].created_at,
-        "last_game_date": Match.objects.all().order_by("-created_at")[0].created_at,
+        "nb_games": data["nb_games"],
+        "first_game_date": parse_snapshot_date(data["first_game_date"]),
+        "last_game_date": parse_snapshot_date(data["last_game_date"]),
+        # The stream only exists when served over ASGI, see lidlboards.asgi
+        "live_url": LIVE_PATH if settings.LIVE_UPDATES else None,
     }
 
     return render(request, "pubg/player_list.html", context)
 
 
 def player_search(request):
-    if request.method != "POST":
-        return HttpResponseNotAllowed(["POST"], "<h1>405 Method Not Allowed</h1>")
+    # A GET form, so that cached pages don't need a CSRF token
+    if request.method != "GET":
+        return HttpResponseNotAllowed(["GET"], "<h1>405 Method Not Allowed</h1>")
 
-    form = PlayerSearchForm(request.POST)
+    form = PlayerSearchForm(request.GET)
 
     if form.is_valid():
         query = form.cleaned_data["player_name"]
         context = {
             "query": query,
-            "players": Player.objects.filter(name__icontains=query),
+            "players": Player.objects.search(query),
         }
     else:
         context = {
-            "query": form.data["player_name"],
+            "query": form.data.get("player_name", ""),
             "players": [],
         }
         for error in form.errors["player_name"]:
@@ -323,15 +355,42 @@ def player_search(request):
     return render(request, "pubg/search_results.html", context)
 
 
+AUTOCOMPLETE_MIN_LENGTH = 3
+AUTOCOMPLETE_LIMIT = 10
+AUTOCOMPLETE_MAX_LIMIT = 25
+
+
+def player_autocomplete(request):
+    """
+    Suggestions for the search box: names starting with the query first, then most games
+    Not cached: every keystroke is a new query, the cache would fill with one-off prefixes
+    """
+    query = request.GET.get("q", "").strip()
+    try:
+        limit = min(int(request.GET.get("limit", AUTOCOMPLETE_LIMIT)), AUTOCOMPLETE_MAX_LIMIT)
+    except ValueError:
+        limit = AUTOCOMPLETE_LIMIT
+
+    players = []
+    if len(query) >= AUTOCOMPLETE_MIN_LENGTH and limit > 0:
+        players = (
+            Player.objects.search(query)
+            .annotate(is_prefix=Case(When(name__istartswith=query, then=1), default=0))
+            .order_by("-is_prefix", "-games_sniped", "name")
+            .values("id", "name", "games_sniped")[:limit]
+        )
+    return JsonResponse({"query": query, "players": list(players)})
+
+
+@cache_page_by_generation()
 def player_view(request, account_id):
     player = Player.objects.filter(id=account_id)[0]
-    kills_table = []
-    for weapon in WEAPON_NAMES:
-        kill_count = PlayerMatchStats.objects.filter(
-            player=player, killed_forsen_with=weapon
-        ).count()
-        if kill_count > 0:
-            kills_table.append((get_icon_html(weapon), kill_count))
+    kill_counts = player.kills_by_weapon()
+    kills_table = [
+        (get_icon_html(weapon), kill_counts[weapon])
+        for weapon in WEAPON_NAMES
+        if kill_counts.get(weapon, 0) > 0
+    ]
     context = {
         "player": player,
         "kills_table": kills_table,
@@ -341,3 +400,164 @@ def player_view(request, account_id):
 
 def index(request):
     return render(request, "pubg/index.html", {})
+
+
+# JSON API for stream overlays and bots. Responses are cached per stats generation like the
+# pages, so polling them costs a 304 until the next ingestion
+API_PLAYER_FIELDS = (
+    "id",
+    "name",
+    "killscore",
+    "kills",
+    "deaths",
+    "games_sniped",
+    "kd",
+    "dpg",
+    "kpg",
+)
+API_PAGE_SIZE = 25
+API_MAX_PAGE_SIZE = 100
+
+
+def api_error(message: str, status: int = 400) -> JsonResponse:
+    return JsonResponse({"error": message}, status=status)
+
+
+def api_fields(request, allowed: tuple[str, ...]) -> list[str]:
+    """Fields asked for with ?fields=name,kills, all of them by default"""
+    if not (fields := request.GET.get("fields")):
+        return list(allowed)
+    fields = fields.split(",")
+    if unknown := [field for field in fields if field not in allowed]:
+        raise ValueError(f"Unknown fields: {', '.join(unknown)}")
+    return fields
+
+
+def normalize_fields(allowed: tuple[str, ...]):
+    """Normalizes ?fields= into the order of `allowed`, for the page cache"""
+
+    def normalize(fields: str) -> str:
+        requested = fields.split(",") if fields else allowed
+        if any(field not in allowed for field in requested):
+            raise ValueError("Unknown fields")
+        return ",".join(field for field in allowed if field in requested)
+
+    return normalize
+
+
+def normalize_limit(limit: str) -> str:
+    return str(int(limit))
+
+
+def encode_cursor(values: list) -> str:
+    return base64.urlsafe_b64encode(json.dumps(values).encode()).decode().rstrip("=")
+
+
+def parse_cursor(cursor: str):
+    try:
+        return json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+    except ValueError:
+        raise ValueError("Invalid cursor")
+
+
+def normalize_cursor(cursor: str) -> str:
+    return encode_cursor(parse_cursor(cursor))
+
+
+def valid_cursor_value(field_name: str, value) -> bool:
+    """Whether a decoded cursor value can be compared with this Player field in SQL"""
+    field = Player._meta.get_field(field_name)
+    # bool is an int, but not a value of any key
+    if isinstance(value, bool):
+        return False
+    if isinstance(field, FloatField):
+        return isinstance(value, (int, float)) and math.isfinite(value)
+    if isinstance(field, IntegerField):
+        return isinstance(value, int) and -(2**63) <= value < 2**63
+    return isinstance(value, str)
+
+
+def decode_cursor(cursor: str, keys: list[str]) -> list:
+    values = parse_cursor(cursor)
+    if not isinstance(values, list) or len(values) != len(keys):
+        raise ValueError("Invalid cursor")
+    if not all(valid_cursor_value(key, value) for key, value in zip(keys, values)):
+        raise ValueError("Invalid cursor")
+    return values
+
+
+def keyset_after(order_by: tuple[str, ...], values: list) -> Q:
+    """
+    Rows that come after the row with these `values` of the `order_by` keys
+    The first key is also bounded on its own, so that the scan starts in the index instead
+    of filtering every row before the cursor
+    """
+    keys = [(key.lstrip("-"), key.startswith("-")) for key in order_by]
+    after = Q()
+    for i, (field, descending) in enumerate(keys):
+        equal = {previous: value for (previous, _), value in zip(keys[:i], values)}
+        after |= Q(**equal, **{f"{field}__{'lt' if descending else 'gt'}": values[i]})
+    first_field, descending = keys[0]
+    return Q(**{f"{first_field}__{'lte' if descending else 'gte'}": values[0]}) & after
+
+
+@cache_page_by_generation(
+    fields=normalize_fields(API_PLAYER_FIELDS), after=normalize_cursor, limit=normalize_limit
+)
+def api_leaderboard(request, ranking):
+    """
+    One page of a ranking of LeaderboardSnapshot.RANKINGS, continued with ?after=<cursor>
+    from the "next" URL of the previous page
+    """
+    if ranking not in LeaderboardSnapshot.RANKINGS:
+        return api_error(f"Unknown leaderboard {ranking}", status=404)
+    order_by, only_regulars = LeaderboardSnapshot.RANKINGS[ranking]
+    keys = [key.lstrip("-") for key in order_by]
+    try:
+        fields = api_fields(request, API_PLAYER_FIELDS)
+        cursor = request.GET.get("after")
+        cursor = decode_cursor(cursor, keys) if cursor else None
+    except ValueError as e:
+        return api_error(str(e))
+    try:
+        limit = int(request.GET.get("limit", API_PAGE_SIZE))
+    except ValueError:
+        limit = None
+    if limit is None or not 1 <= limit <= API_MAX_PAGE_SIZE:
+        return api_error(f"limit must be between 1 and {API_MAX_PAGE_SIZE}")
+
+    players = Player.objects.regulars() if only_regulars else Player.objects.all()
+    if cursor is not None:
+        players = players.filter(keyset_after(order_by, cursor))
+    # One more row than asked for tells whether there is a next page
+    rows = list(players.order_by(*order_by).values(*fields, *keys)[: limit + 1])
+
+    next_url = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        query = request.GET.copy()
+        query["after"] = encode_cursor([rows[-1][key] for key in keys])
+        next_url = f"{request.path}?{query.urlencode()}"
+    return JsonResponse(
+        {
+            "leaderboard": ranking,
+            "generation": Website.cached().generation,
+            "players": [{field: row[field] for field in fields} for row in rows],
+            "next": next_url,
+        }
+    )
+
+
+@cache_page_by_generation(fields=normalize_fields((*API_PLAYER_FIELDS, "kills_by_weapon")))
+def api_player(request, account_id):
+    try:
+        fields = api_fields(request, (*API_PLAYER_FIELDS, "kills_by_weapon"))
+    except ValueError as e:
+        return api_error(str(e))
+    if (player := Player.objects.filter(id=account_id).first()) is None:
+        return api_error(f"Unknown player {account_id}", status=404)
+
+    data = {field: getattr(player, field) for field in fields if field != "kills_by_weapon"}
+    if "kills_by_weapon" in fields:
+        data["kills_by_weapon"] = player.kills_by_weapon()
+    return JsonResponse({"generation": Website.cached().generation, "player": data})